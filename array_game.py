@@ -0,0 +1,116 @@
+import numpy as np
+from agent import JumpAgent, SwapAgent
+from board import *
+from game import Game, JumpGame, SwapGame
+
+# Stores the board as an int8 type array (EMPTY for empty cells) instead of a grid of Agent objects.
+# Agents returned by agent_at are throwaway views, so the UI can keep using agent.pos and agent.utility().
+class ArrayBoard:
+    agent_class = None
+
+    def agent_at(self, pos):
+        agent_type = self.types[pos]
+        if agent_type == EMPTY:
+            return None
+        return self.agent_class(self, int(agent_type), pos)
+
+    def agent_type_at(self, pos):
+        agent_type = self.types[pos]
+        if agent_type == EMPTY:
+            return None
+        return int(agent_type)
+
+    def load_types(self, types, counts = None):
+        self.grid = None
+        Game.load_types(self, types, counts)
+        if isinstance(self, JumpGame):
+            self.agent_count = self.r + self.b
+
+    def fill_types(self, counts):
+        cells = list(range(self.width*self.height))
+        self.rng.shuffle(cells)
+        flat = np.full(self.width*self.height, EMPTY, dtype=np.int8)
+        start = 0
+        for agent_type, agent_count in enumerate(counts):
+            flat[cells[start:start+agent_count]] = agent_type
+            start += agent_count
+        self.types = flat.reshape((self.width, self.height))
+
+class ArrayJumpGame(ArrayBoard, JumpGame):
+    agent_class = JumpAgent
+
+    def place_agents(self, r, b):
+        assert r+b < self.width*self.height
+        self.NE = False
+        self.r = r
+        self.b = b
+        self.fill_types([r, b])
+
+    def generate_grid(self):
+        self.NE = False
+        self.grid = None
+        self.place_agents(int(self.agent_count* (1-self.blue_agent_ratio)), int(self.agent_count * self.blue_agent_ratio))
+        self.rebuild_neighbor_counts()
+        self.jump_target = None
+        self.jumping_agent = None
+        self.simulation_state = 0
+        print("Local Segregation: ", self.ls)
+
+    def execute_jump(self):
+        if self.jumping_agent and self.jump_target:
+            old_pos = self.jumping_agent.pos
+            self.move_type(old_pos, self.jump_target)
+            self.jumping_agent.pos = self.jump_target
+            self.agent_moved(old_pos, self.jump_target)
+        self.jumping_agent = None
+        self.jump_target = None
+
+    # the jumps do not interfere, so the board and the neighbor counts are updated for all of them at once
+    def apply_jumps(self, jumps):
+        origins = np.array([x*self.height + y for (x, y), _ in jumps])
+        targets = np.array([x*self.height + y for _, (x, y) in jumps])
+        deltas = jump_link_deltas(self.types, self.counts, self.self_mult, origins, targets)
+        move_agents(self.types, self.counts, self.offsets, origins, targets)
+        self.jumps_made(origins.tolist(), targets.tolist())
+        if self.move_log is not None:
+            self.move_log.record_batch(zip(origins.tolist(), targets.tolist()))
+        links = self.same_type_links + np.cumsum(deltas)
+        self.same_type_links = int(links[-1])
+        if self.metrics is not None:
+            # LS(G) after each of the jumps, as if they were made one after another
+            for value in links.tolist():
+                self.metrics.record(value / (len(self.offsets) * (self.r + self.b)))
+
+    # Keeps the search indexes of JumpGame.find_jump up to date after jumps made at once (flat indices). They are
+    # only built once the parallel search runs out of jumps, so large batches before that cost nothing here.
+    def jumps_made(self, origins, targets):
+        if self.unhappy is None:
+            return
+        for origin, target in zip(origins, targets):
+            self.agent_moved(divmod(origin, self.height), divmod(target, self.height))
+
+class ArraySwapGame(ArrayBoard, SwapGame):
+    agent_class = SwapAgent
+
+    def place_agents(self, r, b):
+        assert r+b == self.width*self.height
+        self.r = r
+        self.b = b
+        self.NE = False
+        self.fill_types([r, b])
+
+    def generate_grid(self):
+        self.NE = False
+        self.grid = None
+        num_blue = int(self.width * self.height * self.blue_agent_ratio)
+        self.place_agents(self.width*self.height - num_blue, num_blue)
+        self.rebuild_neighbor_counts()
+        self.simulation_state = 0
+        print("Local Segregation: ", self.ls)
+
+    def execute_swap(self):
+        if self.swap_agent1 and self.swap_agent2:
+            pos1, pos2 = self.swap_agent1.pos, self.swap_agent2.pos
+            self.swap_types(pos1, pos2)
+            self.swap_agent1.pos, self.swap_agent2.pos = pos2, pos1
+            self.agents_swapped(pos1, pos2)
\ No newline at end of file
@@ -0,0 +1,324 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+from agent import Agent, SwapAgent, is_greater
+from game import JumpGame
+from headless import GAME_CLASSES, make_utility, make_game
+from board import MAX_NEIGHBORS
+from utilities import CustomUtility, array_locals, ARRAY_CONSTANTS, ARRAY_BINARY
+
+# Times the simulation hot paths over board sizes, densities and both neighborhoods, e.g.
+#   python benchmark.py run --output before.json
+#   python benchmark.py run --output after.json
+#   python benchmark.py compare before.json after.json
+# Every run also checks that seeded games still make exactly the moves recorded in REFERENCE_PATH, so an
+# optimization cannot silently change the dynamics, and that each of these moves is improving by brute force, so the
+# reference itself is not wrong. `python benchmark.py check --update` rewrites the reference after an intended
+# change of behavior.
+
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_reference.json")
+UTILITY_NAMES = ["single-peaked", "tau", "tau-no-seg", "trapezoid", "rectangle", "custom"]
+
+# Times batches of calls that take at least a millisecond, `repeat` times or until `budget` seconds are used up.
+# Like timeit, the fastest batch counts, as slower ones were only disturbed by other processes.
+# Returns (seconds per call, calls).
+def time_calls(function, repeat, budget):
+    number = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - t
+        if elapsed >= 1e-3 or number >= 1 << 16:
+            break
+        number *= 2
+    best, calls = elapsed / number, number
+    start = time.perf_counter()
+    for _ in range(repeat - 1):
+        if time.perf_counter() - start >= budget:
+            break
+        t = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - t) / number)
+        calls += number
+    return best, calls
+
+# times find_jump / find_swap on its own while the game keeps moving, returns (seconds per call, calls)
+def time_find(game, calls, budget):
+    jump = isinstance(game, JumpGame)
+    game.find_jump() if jump else game.find_swap() # builds the search indexes
+    times = []
+    start = time.perf_counter()
+    while len(times) < calls and time.perf_counter() - start < budget:
+        t = time.perf_counter()
+        if jump:
+            game.jumping_agent, game.jump_target, game.jump_new_utility = game.find_jump()
+            found = game.jumping_agent is not None
+        else:
+            game.swap_agent1, game.swap_agent2 = game.find_swap()
+            found = game.swap_agent1 is not None
+        times.append(time.perf_counter() - t)
+        if not found:
+            break
+        game.execute_jump() if jump else game.execute_swap()
+    return statistics.median(times), len(times)
+
+# a fixed mix of interpreter and NumPy work; compare divides by its ratio, so runs on a machine that is
+# faster or busier overall are not all flagged
+def calibration():
+    cells = np.arange(100000) % 3
+    def work():
+        total = 0
+        for i in range(2000):
+            total += i * i
+        np.roll(cells, 1).sum()
+    return time_calls(work, 20, 2.0)[0]
+
+def quiet_game(*args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return make_game(*args, **kwargs)
+
+def game_benchmarks(args):
+    for size, torus, mode, engine in itertools.product(args.sizes, args.torus, ["jump", "swap"], args.engines):
+        for density in (args.densities if mode == "jump" else [1.0]):
+            config = {"size": size, "torus": torus, "mode": mode, "engine": engine, "density": density}
+            if engine == "object" and size > args.object_limit:
+                continue
+            game = quiet_game(mode, engine, size, size, make_utility("tau"), density, torus = torus, seed = 0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                generate, calls = time_calls(game.generate_grid, args.repeat, args.budget)
+            yield dict(config, name="generate_grid", seconds=generate, calls=calls)
+            seconds, calls = time_calls(game.recompute_local_segregation, args.repeat, args.budget)
+            yield dict(config, name="local_segregation", seconds=seconds, calls=calls)
+            seconds, calls = time_calls(lambda: game.ls, args.repeat, args.budget)
+            yield dict(config, name="ls", seconds=seconds, calls=calls)
+            find, calls = time_find(game, args.moves, args.budget)
+            yield dict(config, name="find_jump" if mode == "jump" else "find_swap", seconds=find, calls=calls)
+            if args.render:
+                for name, seconds, calls in time_render(game, args):
+                    yield dict(config, name=name, seconds=seconds, calls=calls)
+
+# Agent.utility for every utility class, on a 50x50 jump game of the object engine
+def utility_benchmarks(args):
+    game = quiet_game("jump", "object", 50, 50, make_utility("tau"), 0.8, seed = 0)
+    agents = game.agents
+    for name in UTILITY_NAMES:
+        game.set_utility_function(make_utility(name))
+        game.utility_function.table()
+        def utilities():
+            for agent in agents:
+                Agent.utility(agent)
+        seconds, calls = time_calls(utilities, args.repeat, args.budget)
+        yield {"name": "Agent.utility", "utility": name, "seconds": seconds / len(agents), "calls": calls * len(agents)}
+
+# GameRenderer.draw_on on an offscreen surface: a full frame, and a frame after a single move
+def time_render(game, args):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    from render import GameRenderer
+    if not pygame.get_init():
+        pygame.init()
+        pygame.display.set_mode((1, 1))
+    screen = pygame.Surface((args.window[0], args.window[1]))
+    font = pygame.font.Font(pygame.font.get_default_font(), 12)
+    renderer = GameRenderer(game)
+    renderer.adapt_to_windowsize(args.window[0], args.window[1])
+    def full_frame():
+        renderer.view_surface = None
+        renderer.draw_on(screen, font)
+    full, full_calls = time_calls(full_frame, args.repeat, args.budget)
+    yield "draw_on_full", full, full_calls
+    # the move is made outside the timed part, so only drawing the changed cells counts
+    times = []
+    start = time.perf_counter()
+    while len(times) < 50 and time.perf_counter() - start < args.budget:
+        game.step()
+        t = time.perf_counter()
+        renderer.draw_on(screen, font)
+        times.append(time.perf_counter() - t)
+    yield "draw_on_move", statistics.median(times), len(times)
+
+# Replays the moves of a game on a copy of its board in an object game and checks them with the agents' brute-force
+# methods, which use no search index: every move has to be improving, and no agent may have an improving move left
+# once the game reports a Nash equilibrium.
+class MoveChecker:
+    def __init__(self, game, mode):
+        self.jump = mode == "jump"
+        self.reference = quiet_game(mode, "object", game.width, game.height, game.utility_function,
+                                    torus = "8-Torus" if game.diagonal_neighbors else "4-Torus",
+                                    self_inclusive = game.self_inclusive)
+        self.reference.load_types(np.array(game.types))
+        self.invalid_moves = 0
+
+    def record(self, cell1, cell2):
+        reference = self.reference
+        agent = reference.agent_at(divmod(cell1, reference.height))
+        pos = divmod(cell2, reference.height)
+        if self.jump:
+            self.invalid_moves += not is_greater(agent.utility_at(pos), agent.utility())
+            agent.jump_to(pos)
+        else:
+            other_agent = reference.agent_at(pos)
+            self.invalid_moves += not agent.is_improving_swap(other_agent)
+            SwapAgent.swap(reference, agent, other_agent)
+
+    def improving_move_left(self):
+        reference = self.reference
+        if self.jump:
+            return any(agent.find_improving_jump(reference.empty_nodes)[0] is not None for agent in reference.agents)
+        return any(agent.find_improving_swap(reference.red_agents) is not None for agent in reference.blue_agents)
+
+# sha256 of the moves a seeded game makes, for every engine, mode, neighborhood and utility, and the games whose
+# moves MoveChecker rejected
+def move_digests(moves = 2000, size = 30):
+    digests = {}
+    invalid = []
+    class MoveDigest:
+        def __init__(self, checker):
+            self.hash = hashlib.sha256()
+            self.checker = checker
+        def record(self, cell1, cell2):
+            self.hash.update(np.array([cell1, cell2], dtype=np.int32).tobytes())
+            self.checker.record(cell1, cell2)
+        def record_batch(self, moves):
+            for cell1, cell2 in moves:
+                self.record(cell1, cell2)
+        def keyframe(self, game):
+            self.hash.update(b"K" + np.ascontiguousarray(game.types, dtype=np.int8).tobytes())
+    for (mode, engine), torus, utility in itertools.product(GAME_CLASSES, ["8-Torus", "4-Torus"], UTILITY_NAMES):
+        game = quiet_game(mode, engine, size, size, make_utility(utility), torus = torus, seed = 1)
+        checker = MoveChecker(game, mode)
+        digest = MoveDigest(checker)
+        digest.keyframe(game)
+        game.move_log = digest
+        done = 0
+        while done < moves and game.step():
+            done += 1
+        key = "%s/%s/%s/%s" % (mode, engine, torus, utility)
+        digests[key] = "%d:%s" % (done, digest.hash.hexdigest())
+        if checker.invalid_moves or (game.NE and checker.improving_move_left()):
+            invalid.append(key)
+    return digests, invalid
+
+def check_moves(update = False):
+    digests, invalid = move_digests()
+    if update or not os.path.exists(REFERENCE_PATH):
+        with open(REFERENCE_PATH, "w") as f:
+            json.dump(digests, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return {"ok": not invalid, "updated": True, "mismatches": [], "invalid": invalid}
+    with open(REFERENCE_PATH) as f:
+        reference = json.load(f)
+    mismatches = sorted(key for key in reference if digests.get(key) != reference[key])
+    return {"ok": not mismatches and not invalid, "updated": False, "mismatches": mismatches, "invalid": invalid}
+
+# Custom formulas over every name with a NumPy counterpart, whose tables (evaluated over an array of fractions) must
+# match evaluating the formula fraction by fraction. NumPy's exp, sinh, ... may round differently in the last
+# bits, far below the epsilon utilities are compared with.
+def check_utility_tables(tolerance = 1e-12):
+    same, other = np.indices((MAX_NEIGHBORS+1, MAX_NEIGHBORS+1))
+    fractions = np.divide(same, same + other, out=np.zeros(same.shape), where=same + other > 0)
+    mismatches = []
+    for name in array_locals:
+        if name in ARRAY_CONSTANTS:
+            formulas = ["frac * %s" % name, "%s - frac" % name]
+        elif name in ARRAY_BINARY or name in ("min", "max"):
+            formulas = ["%s(frac, 0.3)" % name, "%s(0.7 - frac, frac - 0.4)" % name]
+        else:
+            formulas = ["%s(frac)" % name, "%s(3*frac - 1.4)" % name, "%s(2.5*frac)" % name]
+        for formula in formulas:
+            utility = CustomUtility(formula)
+            with np.errstate(all="ignore"):
+                table = utility.table()
+                utility.compiled()
+                scalar = np.array([utility.evaluate_scalar(float(f)) for f in fractions.ravel()]).reshape(table.shape)
+            if not np.allclose(table, scalar, rtol=tolerance, atol=tolerance, equal_nan=True):
+                mismatches.append(formula)
+    return mismatches
+
+def result_key(result):
+    return tuple((field, result[field]) for field in ("name", "engine", "mode", "size", "torus", "density", "utility") if field in result)
+
+def compare(before_path, after_path, threshold):
+    with open(before_path) as f:
+        before_run = json.load(f)
+    with open(after_path) as f:
+        after_run = json.load(f)
+    before = {result_key(result): result for result in before_run["results"]}
+    after = {result_key(result): result for result in after_run["results"]}
+    speed = after_run["meta"]["calibration"] / before_run["meta"]["calibration"]
+    print("machine speed factor %.2f (after / before calibration), divided out of the ratios" % speed)
+    regressions = 0
+    for key, result in after.items():
+        if key not in before:
+            continue
+        ratio = result["seconds"] / before[key]["seconds"] / speed if before[key]["seconds"] > 0 else float("inf")
+        flag = "REGRESSION" if ratio > threshold else "faster" if ratio < 1 / threshold else ""
+        regressions += flag == "REGRESSION"
+        label = " ".join(str(value) for _, value in key)
+        print("%-60s %12.3g %12.3g %7.2fx %s" % (label, before[key]["seconds"], result["seconds"], ratio, flag))
+    print("%d regressions (slower than %.2fx)" % (regressions, threshold))
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="time the hot paths and check the seeded move sequences")
+    run.add_argument("--sizes", type=int, nargs="+", default=[15, 50, 200, 1000])
+    run.add_argument("--densities", type=float, nargs="+", default=[0.5, 0.9], help="jump mode only, swap boards are full")
+    run.add_argument("--torus", nargs="+", choices=["8-Torus", "4-Torus"], default=["8-Torus", "4-Torus"])
+    run.add_argument("--engines", nargs="+", choices=["object", "array"], default=["object", "array"])
+    run.add_argument("--object-limit", type=int, default=200, help="largest board size for the object engine")
+    run.add_argument("--moves", type=int, default=200, help="find_jump / find_swap calls per configuration")
+    run.add_argument("--repeat", type=int, default=5, help="calls of the other benchmarks per configuration")
+    run.add_argument("--budget", type=float, default=5.0, help="seconds per benchmark and configuration at most")
+    run.add_argument("--no-render", dest="render", action="store_false", help="skip draw_on (needs pygame)")
+    run.add_argument("--window", type=int, nargs=2, default=[1280, 800])
+    run.add_argument("--output", default="benchmark.json")
+    comparison = commands.add_parser("compare", help="flag benchmarks that got slower between two runs")
+    comparison.add_argument("before")
+    comparison.add_argument("after")
+    comparison.add_argument("--threshold", type=float, default=1.2, help="slowdown factor counted as a regression")
+    check = commands.add_parser("check", help="only check the seeded move sequences against the reference and the custom utility tables")
+    check.add_argument("--update", action="store_true", help="record the current move sequences as the reference")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare(args.before, args.after, args.threshold) else 0)
+    if args.command == "check":
+        identity = check_moves(args.update)
+        identity["utility_table_mismatches"] = check_utility_tables()
+        identity["ok"] = identity["ok"] and not identity["utility_table_mismatches"]
+        print(json.dumps(identity))
+        sys.exit(0 if identity["ok"] else 1)
+
+    calibration_seconds = calibration()
+    results = []
+    for result in itertools.chain(utility_benchmarks(args), game_benchmarks(args)):
+        results.append(result)
+        print(" ".join("%s=%s" % (key, value) for key, value in result.items()))
+    identity = check_moves()
+    print("move sequences", "match the reference" if not identity["mismatches"] else "differ: " + ", ".join(identity["mismatches"]))
+    if identity["invalid"]:
+        print("moves or Nash equilibria rejected by the brute-force check: " + ", ".join(identity["invalid"]))
+    meta = {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"), "argv": sys.argv[1:],
+            "calibration": (calibration_seconds + calibration()) / 2}
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results, "identity": identity}, f, indent=2)
+    sys.exit(0 if identity["ok"] else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import numpy as np
+from agent import is_greater
+
+EMPTY = -1
+MAX_NEIGHBORS = 9 # 8 neighbors plus the cell itself
+
+def neighbor_offsets(diagonal_neighbors, self_inclusive):
+    return [(i,j) for i in range(-1,2) for j in range(-1,2)
+            if (diagonal_neighbors or (i == 0 or j == 0)) and (self_inclusive or (i != 0 or j != 0))]
+
+# mult[dx, dy] = number of offsets that land on (x+dx, y+dy) from (x, y) after wrapping.
+# On boards smaller than 3x3 several offsets wrap onto the same cell.
+def multiplicity_table(offsets, width, height):
+    mult = np.zeros((width, height), dtype=np.int8)
+    for dx, dy in offsets:
+        mult[dx % width, dy % height] += 1
+    return mult
+
+# counts[t][..., x, y] = number of type t agents in the neighborhood of (x, y)
+def neighbor_counts(types, offsets):
+    counts = np.zeros((2,) + types.shape, dtype=np.int8)
+    for agent_type in range(2):
+        mask = (types == agent_type).astype(np.int8)
+        for dx, dy in offsets:
+            counts[agent_type] += np.roll(mask, (-dx, -dy), axis=(-2, -1))
+    return counts
+
+# number of ordered same-type pairs (v, w) with w in the neighborhood of v, i.e. sum_{v in V} f_G(v)
+def same_type_links(types, counts):
+    return int(sum((counts[agent_type] * (types == agent_type)).sum(dtype=np.int64) for agent_type in range(2)))
+
+# LS(G) = 1 / |V| * sum_{v in V}  (f_G(v) / deg(v)), computed from scratch
+def local_segregation(types, offsets):
+    agent_total = int((types != EMPTY).sum())
+    if agent_total == 0: return 0
+    return same_type_links(types, neighbor_counts(types, offsets)) / (len(offsets) * agent_total)
+
+# tables[t][c0, c1] = utility of a type t agent seeing c0 type-0 and c1 type-1 neighbors
+def type_tables(table):
+    return np.stack((table, table.T))
+
+def shifted(counts, agent_type, delta):
+    c = [counts[0], counts[1]]
+    c[agent_type] = np.clip(c[agent_type] + delta, 0, MAX_NEIGHBORS)
+    return c[0], c[1]
+
+# cells whose neighborhood contains a marked cell
+def near_cells(mask, offsets):
+    near = np.zeros(mask.shape, dtype=bool)
+    for dx, dy in offsets:
+        near |= np.roll(mask, (-dx, -dy), axis=(0, 1))
+    return near
+
+# Selects improving jumps such that no jump's origin or target lies in the neighborhood of another jump's origin
+# or target. Every jump then sees the same compositions as if it was made alone, so making them one after another,
+# in any order, is a valid sequence of improving jumps.
+# The board is colored in 2x2 blocks. Per round, agents of one color are matched to empty cells of another color
+# (cells of the same color never see each other) that are not next to the agent, and pairs next to a jump
+# of the same round or of an earlier one are left out.
+# Origins and targets are taken from the rows in `rows`, the whole torus by default. Other rows are only read, so
+# types and counts can be a strip of a larger board as long as the rows are at least one row away from its edges.
+# Returns a list of (origin, target) flat indices and the number of agents and cells looked at.
+def select_jumps(types, counts, tables, offsets, self_mult, rng, rounds = 4, rows = None):
+    # on a torus of odd size the last row and column would see the first one, they are left out
+    first, stop = (0, types.shape[0] - types.shape[0] % 2) if rows is None else rows
+    height = types.shape[1] - types.shape[1] % 2
+    utilities = [tables[agent_type][counts[0], counts[1]].ravel() for agent_type in range(2)]
+    # utility at an empty cell that does not see the agent's old position
+    target_utilities = [tables[agent_type][shifted(counts, agent_type, self_mult)].ravel() for agent_type in range(2)]
+    colors = [(x, y) for x in range(2) for y in range(2)]
+    color_pairs = [(c1, c2) for c1 in colors for c2 in colors if c1 != c2]
+    selected = np.zeros(types.shape, dtype=bool)
+    jumps = []
+    evaluations = 0
+    for i in rng.permutation(len(color_pairs))[:rounds]:
+        (mx, my), (tx, ty) = color_pairs[i]
+        blocked = selected | near_cells(selected, offsets)
+        movers = np.zeros(types.shape, dtype=bool)
+        movers[first+mx:stop:2, my:height:2] = True
+        movers &= (types != EMPTY) & ~blocked
+        free = np.zeros(types.shape, dtype=bool)
+        free[first+tx:stop:2, ty:height:2] = True
+        free &= (types == EMPTY) & ~blocked
+        new_jumps = []
+        for agent_type in rng.permutation(2).tolist():
+            agent_cells = np.flatnonzero(movers & (types == agent_type))
+            empty_cells = np.flatnonzero(free)
+            if len(agent_cells) == 0 or len(empty_cells) == 0:
+                continue
+            evaluations += len(agent_cells) + len(empty_cells)
+            # hardest to please agents first, each matched to the best remaining target; ties in random order
+            u, v = utilities[agent_type][agent_cells], target_utilities[agent_type][empty_cells]
+            order, target_order = np.lexsort((rng.random(len(u)), -u)), np.lexsort((rng.random(len(v)), -v))
+            agent_cells, u = agent_cells[order].tolist(), u[order].tolist()
+            empty_cells, v = empty_cells[target_order].tolist(), v[target_order].tolist()
+            j = 0
+            for cell, agent_u in zip(agent_cells, u):
+                if j == len(empty_cells):
+                    break
+                if is_greater(v[j], agent_u):
+                    new_jumps.append((cell, empty_cells[j]))
+                    free.flat[empty_cells[j]] = False
+                    j += 1
+        if not new_jumps:
+            continue
+        origins = np.zeros(types.shape, dtype=bool)
+        origins.flat[[origin for origin, _ in new_jumps]] = True
+        conflicts = near_cells(origins, offsets)
+        for origin, target in new_jumps:
+            if not conflicts.flat[target]:
+                jumps.append((origin, target))
+                selected.flat[origin] = selected.flat[target] = True
+    return jumps, evaluations
+
+# Change of same_type_links by each of a set of non-interfering jumps (flat indices), from the counts before any of
+# them is made: with c agents of its type around the origin (itself included self_mult times) and c' around the
+# target, the agent loses 2 * (c - self_mult) + self_mult links and gains 2 * c' + self_mult.
+def jump_link_deltas(types, counts, self_mult, origins, targets):
+    moved = types.ravel()[origins].astype(np.int64)
+    same = counts.reshape(2, -1)
+    return 2 * (same[moved, targets].astype(np.int64) - same[moved, origins] + self_mult)
+
+# makes non-interfering jumps (flat indices) at once, updating the board and the neighbor counts in place
+def move_agents(types, counts, offsets, origins, targets):
+    moved = types.ravel()[origins]
+    types.flat[targets] = moved
+    types.flat[origins] = EMPTY
+    for agent_type in range(2):
+        delta = np.zeros(types.shape, dtype=np.int8)
+        delta.flat[targets[moved == agent_type]] = 1
+        delta.flat[origins[moved == agent_type]] = -1
+        for dx, dy in offsets:
+            counts[agent_type] += np.roll(delta, (-dx, -dy), axis=(0,1))
@@ -0,0 +1,233 @@
+import time
+import numpy as np
+from agent import is_greater
+from board import EMPTY, MAX_NEIGHBORS, neighbor_offsets, multiplicity_table, neighbor_counts, type_tables, shifted
+
+# Runs a batch of independent games of the same mode, size and utility function as one (batch, width, height)
+# type array, for statistics over many runs of small boards, e.g.
+#   ensemble = Ensemble.random("swap", 15, 15, TauUtility(Fraction(1,2)), seeds=range(1000))
+#   ensemble.run(max_moves=10000)
+#   ensemble.NE, ensemble.moves, ensemble.ls
+# Every step makes one improving move on every active board: it picks a random agent among those with an improving
+# jump (blue agents with an improving swap in swap mode) and then a random improving empty cell (red agent to
+# swap with). Each board draws from its own random stream, so its run only depends on its seed and not on the rest
+# of the batch. Boards that reach a Nash equilibrium or their move budget drop out of the active batch.
+
+KEYS = (MAX_NEIGHBORS + 1) ** 2
+# (c0, c1) of every composition key c0 * (MAX_NEIGHBORS + 1) + c1, the index into the raveled utility tables
+KEY_COUNTS = np.divmod(np.arange(KEYS), MAX_NEIGHBORS + 1)
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+# one random stream per board: SplitMix64 advances all states at once
+def seed_states(seeds):
+    states = np.array([seed % 2**64 for seed in seeds], dtype=np.uint64)
+    next_uint64(states) # consecutive seeds do not start next to each other in the sequence
+    return states
+
+def next_uint64(states):
+    states += GOLDEN_GAMMA
+    z = states.copy()
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+# a uniform float in [0, 1) per state
+def uniforms(states):
+    return (next_uint64(states) >> np.uint64(11)) * 2.0**-53
+
+# index of a random True in every row of mask, for rows with at least one
+def choose(mask, r):
+    totals = mask.sum(1)
+    nth = np.minimum((r * totals).astype(np.int64), totals - 1)
+    return (np.cumsum(mask, 1) > nth[:, None]).argmax(1)
+
+def composition_keys(counts):
+    return counts[0].astype(np.int16) * (MAX_NEIGHBORS + 1) + counts[1]
+
+# number of cells of each composition key on every board among the marked ones
+def key_histogram(keys, mask):
+    board = np.arange(len(keys)).reshape((-1,) + (1,) * (keys.ndim - 1))
+    return np.bincount((board * KEYS + keys)[mask], minlength=len(keys) * KEYS).reshape(len(keys), KEYS)
+
+class Ensemble:
+    def __init__(self, mode, types, utility_function, seeds, torus = "8-Torus", self_inclusive = True):
+        assert mode in ("jump", "swap")
+        self.mode = mode
+        self.types = np.ascontiguousarray(types, dtype=np.int8)
+        self.batch, self.width, self.height = types.shape
+        self.utility_function = utility_function
+        self.offsets = neighbor_offsets(torus == "8-Torus", self_inclusive)
+        self.mult = multiplicity_table(self.offsets, self.width, self.height)
+        self.self_mult = int(self.mult[0,0])
+        # offsets to other cells, with how often each of them is counted
+        self.near_offsets = [(int(dx), int(dy), int(self.mult[dx,dy])) for dx, dy in zip(*np.nonzero(self.mult))
+                             if (dx, dy) != (0,0)]
+        self.counts = neighbor_counts(self.types, self.offsets)
+        self.links = sum((self.counts[agent_type] * (self.types == agent_type)).sum(axis=(1,2), dtype=np.int64)
+                         for agent_type in range(2))
+        self.agent_total = (self.types != EMPTY).sum(axis=(1,2))
+        self.states = seed_states(seeds)
+        assert len(self.states) == self.batch
+        self.moves = np.zeros(self.batch, dtype=np.int64)
+        self.NE = np.zeros(self.batch, dtype=bool)
+        self.active = np.arange(self.batch)
+        self.pairs_table = None
+
+    # boards placed like make_game does, each shuffled with its own random stream
+    @classmethod
+    def random(cls, mode, width, height, utility_function, seeds, density = 0.8, blue = 0.5, torus = "8-Torus", self_inclusive = True):
+        if mode == "jump":
+            agent_count = int(width*height*density)
+            red_count, blue_count = int(agent_count*(1-blue)), int(agent_count*blue)
+        else:
+            blue_count = int(width*height*blue)
+            red_count = width*height - blue_count
+        states = seed_states(seeds)
+        order = np.argsort(np.stack([uniforms(states) for _ in range(width*height)], axis=1), axis=1)
+        flat = np.full(order.shape, EMPTY, dtype=np.int8)
+        rows = np.arange(len(states))[:, None]
+        flat[rows, order[:, :red_count]] = 0
+        flat[rows, order[:, red_count:red_count+blue_count]] = 1
+        ensemble = cls(mode, flat.reshape(-1, width, height), utility_function, seeds, torus, self_inclusive)
+        ensemble.states = states
+        return ensemble
+
+    # LS(G) of every board
+    @property
+    def ls(self):
+        return np.divide(self.links, len(self.offsets) * self.agent_total,
+                         out=np.zeros(self.batch), where=self.agent_total > 0)
+
+    def run(self, max_moves = None, time_limit = None):
+        start = time.perf_counter()
+        while len(self.active):
+            if time_limit is not None and time.perf_counter() - start >= time_limit:
+                break
+            self.step()
+            if max_moves is not None:
+                self.active = self.active[self.moves[self.active] < max_moves]
+        return time.perf_counter() - start
+
+    # one move on every active board, returns the number of moves made
+    def step(self):
+        active = self.active
+        if len(active) == 0:
+            return 0
+        if len(active) == self.batch:
+            types, counts = self.types, self.counts
+        else:
+            types, counts = self.types[active], self.counts[:, active]
+        movers = self.improving_moves(types, counts).reshape(len(active), -1) > 0
+        found = movers.any(1)
+        self.NE[active[~found]] = True
+        states = self.states[active]
+        r = uniforms(states), uniforms(states)
+        self.states[active] = states
+        if not found.all():
+            active, types, counts, movers = active[found], types[found], counts[:, found], movers[found]
+            r = r[0][found], r[1][found]
+            self.active = active
+            if len(active) == 0:
+                return 0
+        cells = choose(movers, r[0])
+        targets = choose(self.improving_targets(types, counts, cells), r[1])
+        if self.mode == "jump":
+            self.jump(active, cells, targets)
+        else:
+            self.swap(active, cells, targets)
+        self.moves[active] += 1
+        return len(active)
+
+    # Whether a move between a cell with key k and a cell with key l that sees it m times (0: they do not see
+    # each other) is improving, as a boolean array
+    # - jump mode, [t, m, k, l]: an empty cell with key l is better for a type t agent at a cell with key k
+    # - swap mode, [m, k, l]: a blue agent with key k and a red agent with key l both improve by swapping
+    # Cached until the utility function hands out a new table.
+    def improving_pairs(self):
+        table = self.utility_function.table()
+        if table is not self.pairs_table:
+            tables = type_tables(table)
+            s = self.self_mult
+            links = range(int(self.mult.max()) + 1)
+            if self.mode == "jump":
+                self.pairs = np.array([[is_greater(tables[t][shifted(KEY_COUNTS, t, s - m)][None,:], tables[t].ravel()[:,None])
+                                        for m in links] for t in range(2)])
+            else:
+                blue_new = [tables[1][shifted(shifted(KEY_COUNTS, 0, m - s), 1, s - m)] for m in links]
+                red_new = [tables[0][shifted(shifted(KEY_COUNTS, 0, s - m), 1, m - s)] for m in links]
+                self.pairs = np.array([is_greater(blue_new[m][None,:], tables[1].ravel()[:,None]) &
+                                       is_greater(red_new[m][:,None], tables[0].ravel()[None,:]) for m in links])
+            self.pairs_table = table
+        return self.pairs
+
+    # Number of improving moves of every agent (of every blue agent in swap mode), by composition class: partners
+    # that do not see the agent are counted per key, those next to it are corrected offset by offset.
+    def improving_moves(self, types, counts):
+        pairs = self.improving_pairs()
+        keys = composition_keys(counts)
+        board_keys = keys.reshape(len(types), -1)
+        if self.mode == "jump":
+            movers, partners = [types == 0, types == 1], types == EMPTY
+            pairs = list(pairs)
+        else:
+            movers, partners = [types == 1], types == 0
+            pairs = [pairs]
+        partner_keys = key_histogram(keys, partners)
+        near = [(m, keys * KEYS + np.roll(keys, (-dx, -dy), axis=(1,2)), np.roll(partners, (-dx, -dy), axis=(1,2)))
+                for dx, dy, m in self.near_offsets]
+        improving = np.zeros(types.shape, dtype=np.int32)
+        for mover, mover_pairs in zip(movers, pairs):
+            n = np.take_along_axis(partner_keys @ mover_pairs[0].T.astype(np.int32), board_keys, 1).reshape(types.shape)
+            corrections = (mover_pairs.astype(np.int8) - mover_pairs[0]).reshape(len(mover_pairs), -1)
+            for m, pair_keys, near_partners in near:
+                n += corrections[m].take(pair_keys) * near_partners
+            improving += np.where(mover, n, 0)
+        return improving
+
+    # how often every cell sees the chosen cell of its board, (boards, width, height)
+    def link_counts(self, cells):
+        x, y = np.divmod(cells, self.height)
+        dx = (np.arange(self.width)[None,:] - x[:,None]) % self.width
+        dy = (np.arange(self.height)[None,:] - y[:,None]) % self.height
+        return self.mult[dx[:,:,None], dy[:,None,:]]
+
+    # improving targets (partners) of the chosen agent of every board
+    def improving_targets(self, types, counts, cells):
+        pairs = self.improving_pairs()
+        types = types.reshape(len(cells), -1)
+        keys = composition_keys(counts).reshape(len(cells), -1)
+        rows = np.arange(len(cells))
+        m = self.link_counts(cells).reshape(len(cells), -1).astype(np.int64)
+        if self.mode == "jump":
+            m += types[rows, cells][:,None] * pairs.shape[1]
+            partners = types == EMPTY
+        else:
+            partners = types == 0
+        return partners & pairs.ravel().take((m * KEYS + keys[rows, cells][:,None]) * KEYS + keys)
+
+    # like Game.update_neighbor_counts, for one cell on each of the given boards
+    def update_neighbor_counts(self, boards, cells, agent_type, delta):
+        x, y = np.divmod(cells, self.height)
+        if delta > 0:
+            self.links[boards] += 2 * self.counts[agent_type, boards, x, y].astype(np.int64) + self.self_mult
+        for dx, dy in self.offsets:
+            self.counts[agent_type, boards, (x - dx) % self.width, (y - dy) % self.height] += delta
+        if delta < 0:
+            self.links[boards] -= 2 * self.counts[agent_type, boards, x, y].astype(np.int64) + self.self_mult
+
+    def jump(self, boards, origins, targets):
+        types = self.types.reshape(self.batch, -1)
+        agent_type = types[boards, origins].astype(np.int64)
+        self.update_neighbor_counts(boards, origins, agent_type, -1)
+        types[boards, origins] = EMPTY
+        types[boards, targets] = agent_type
+        self.update_neighbor_counts(boards, targets, agent_type, 1)
+
+    def swap(self, boards, cells1, cells2):
+        types = self.types.reshape(self.batch, -1)
+        type1, type2 = types[boards, cells1].astype(np.int64), types[boards, cells2].astype(np.int64)
+        self.update_neighbor_counts(boards, cells1, type1, -1)
+        self.update_neighbor_counts(boards, cells1, type2, 1)
+        self.update_neighbor_counts(boards, cells2, type2, -1)
+        self.update_neighbor_counts(boards, cells2, type1, 1)
+        types[boards, cells1], types[boards, cells2] = type2, type1
@@ -1,18 +1,23 @@
 ﻿import random
-import pygame
-import pygame_gui
 import sys
+import numpy as np
 from fractions import Fraction
-from agent import JumpAgent, SwapAgent
+from agent import JumpAgent, SwapAgent, is_greater
+from board import EMPTY, neighbor_offsets, neighbor_counts, multiplicity_table, type_tables, same_type_links, local_segregation, select_jumps
+from indexes import RandomSet, CompositionIndex
 from utilities import *
 from abc import ABC, abstractmethod
 
 from collections import namedtuple
 
 class Game(ABC):
-    def __init__(self, width, height, utility_function = SinglePeakedUtility(peak = Fraction(1,2))):
+    # all random choices of a game come from its own generator, so seeded runs are reproducible
+    def __init__(self, width, height, utility_function = SinglePeakedUtility(peak = Fraction(1,2)), seed = None):
+        self.rng = random.Random(seed)
+        self.move_log = None # set by movelog.MoveLogWriter
+        self.metrics = None # set by metrics.MetricsHistory
+        self.evaluations = 0 # candidate moves looked at by find_jump / find_swap, read by profiler.Profiler
         self.NE = False
-        self.w_width, self.w_height = 100,100
         self.height = height
         self.width = width
         self.agent_ratio = 1.0
@@ -20,36 +25,45 @@ class Game(ABC):
         self.self_inclusive = True
         self.agent_count = int(self.height*self.width*self.agent_ratio/2)
         self.diagonal_neighbors = True
+        self.offsets = neighbor_offsets(self.diagonal_neighbors, self.self_inclusive)
         self.utility_function = utility_function
-        self.size = 60 # default tile size
         self.simulation_state = 0
-        self.agent_mapping = {0:self.grid_cell("triangle.png"), 1:self.grid_cell("square.png")}
         self.grid = [[None for _ in range(self.height)] for _ in range(self.width)]
         self.agents = []
+
+    # Setting NE to False means something changed the game, so search indexes have to be rebuilt.
+    @property
+    def NE(self):
+        return self._NE
+
+    @NE.setter
+    def NE(self, value):
+        self._NE = value
+        if not value:
+            self.invalidate_indexes()
+
+    def invalidate_indexes(self):
+        pass
+
+    # Positions in cell order, so search indexes built from the same board are the same whatever happened before,
+    # e.g. after a snapshot was loaded.
+    def positions_where(self, mask):
+        return [(int(x), int(y)) for x, y in zip(*np.nonzero(mask))]
+
+    def agent_positions(self):
+        return self.positions_where(self.types != EMPTY)
         
-    # LS(G) = 1 / |V| * sum_{v in V}  (f_G(v) / deg(v))
-    def local_segregation(self, agents):
-        if len(agents) == 0: return 0
-        sum_same_type = 0
-        deg = 8
-        for agent in agents:
-            same_type_agents, other_type_agents = agent.neighborhood_types()
-            sum_same_type += same_type_agents
-        return sum_same_type / (deg * len(self.agents))
-
-    def grid_cell(self, texture = None):
-        square = pygame.Surface((self.size, self.size))
-        square.fill((0, 0, 0))
-        pygame.draw.rect(square, (20,20,20), (0, 0, self.size, self.size), 1)
-        if texture:    
-            tex = pygame.image.load(texture).convert_alpha()
-            tex = pygame.transform.scale(tex, (self.size, self.size))
-            square.blit(tex, (0,0))
-        return square
-    
-    def adjacent(self, i,j):
-        return (self.diagonal_neighbors or (i == 0 or j == 0)) and (self.self_inclusive or (i != 0 or j != 0))
-    
+    # LS(G) = 1 / |V| * sum_{v in V}  (f_G(v) / deg(v)), with sum_{v in V} f_G(v) kept up to date on every move
+    @property
+    def ls(self):
+        agent_total = self.r + self.b
+        if agent_total == 0: return 0
+        return self.same_type_links / (len(self.offsets) * agent_total)
+
+    # recomputes LS(G) from the board alone, to check the incrementally updated value
+    def recompute_local_segregation(self):
+        return local_segregation(self.types, self.offsets)
+
     def wrap_position(self, pos):
         return (pos[0] % self.width, pos[1] % self.height)
 
@@ -63,19 +77,66 @@ class Game(ABC):
         return None
     
     def neighbors(self, pos):
-        return [self.wrap_position((pos[0]+i, pos[1]+j)) for i in range(-1,2) for j in range(-1,2) if self.adjacent(i,j)]
+        return [self.wrap_position((pos[0]+i, pos[1]+j)) for i, j in self.offsets]
  
+    # counts[t][x, y] = number of type t agents in the neighborhood of (x, y), kept up to date on every move.
+    # Counts that are already known, e.g. from a snapshot, can be passed in instead of being recomputed.
+    def rebuild_neighbor_counts(self, counts = None):
+        self.offsets = neighbor_offsets(self.diagonal_neighbors, self.self_inclusive)
+        self.mult = multiplicity_table(self.offsets, self.width, self.height)
+        self.counts = neighbor_counts(self.types, self.offsets) if counts is None else counts
+        self.self_mult = int(self.mult[0,0])
+        # how often one cell can be counted around another, and the number of other cells in a neighborhood
+        self.link_values = set(int(m) for m in np.unique(self.mult)) | {0}
+        self.neighborhood_size = int(np.count_nonzero(self.mult)) - int(self.mult[0,0] > 0)
+        self.same_type_links = same_type_links(self.types, self.counts)
+        if self.move_log is not None:
+            self.move_log.keyframe(self)
+        if self.metrics is not None:
+            self.metrics.record(self.ls)
+
+    # how often an agent at pos2 is counted in the neighborhood of pos1
+    def link_count(self, pos1, pos2):
+        return int(self.mult[(pos2[0]-pos1[0]) % self.width, (pos2[1]-pos1[1]) % self.height])
+
+    # An agent of type t at pos sees counts[t][pos] other agents of its type, each of which sees it back,
+    # plus itself self_mult times.
+    def update_neighbor_counts(self, pos, agent_type, delta):
+        if delta > 0:
+            self.same_type_links += 2*int(self.counts[(agent_type,) + pos]) + self.self_mult
+        for neighbor in self.neighbors(pos):
+            self.counts[(agent_type,) + neighbor] += delta
+        if delta < 0:
+            self.same_type_links -= 2*int(self.counts[(agent_type,) + pos]) + self.self_mult
+
+    def move_type(self, old_pos, new_pos):
+        agent_type = int(self.types[old_pos])
+        self.update_neighbor_counts(old_pos, agent_type, -1)
+        self.types[old_pos] = EMPTY
+        self.types[new_pos] = agent_type
+        self.update_neighbor_counts(new_pos, agent_type, 1)
+        if self.move_log is not None:
+            self.move_log.record(old_pos[0]*self.height + old_pos[1], new_pos[0]*self.height + new_pos[1])
+        if self.metrics is not None:
+            self.metrics.record(self.ls)
+
+    def swap_types(self, pos1, pos2):
+        type1, type2 = int(self.types[pos1]), int(self.types[pos2])
+        if type1 == type2:
+            return
+        self.update_neighbor_counts(pos1, type1, -1)
+        self.update_neighbor_counts(pos1, type2, 1)
+        self.update_neighbor_counts(pos2, type2, -1)
+        self.update_neighbor_counts(pos2, type1, 1)
+        self.types[pos1], self.types[pos2] = type2, type1
+        if self.move_log is not None:
+            self.move_log.record(pos1[0]*self.height + pos1[1], pos2[0]*self.height + pos2[1])
+        if self.metrics is not None:
+            self.metrics.record(self.ls)
+
     def positions(self):
         return ((x,y) for x in range(self.width) for y in range(self.height))
     
-    def adapt_to_windowsize(self, w, h):
-        self.w_width = w
-        self.w_height = h
-        self.size = int(min(0.9*w/self.width, 0.9*h/self.height))
-        if self.size < 5:
-            self.size = 5
-        self.agent_mapping = {None: self.grid_cell(), 0:self.grid_cell("triangle.png"), 1:self.grid_cell("square.png")}
-    
     def set_grid_size(self, width, height):
         if width == self.width and height == self.height:
             return
@@ -83,27 +144,39 @@ class Game(ABC):
         self.height = height
         self.width = width
         self.agent_count = int(height*width*self.agent_ratio/2)
-        self.adapt_to_windowsize(self.w_width, self.w_height)
         self.generate_grid()
 
+    # replaces the board, e.g. with one read back from a move log or a snapshot
+    def load_types(self, types, counts = None):
+        self.width, self.height = types.shape
+        self.types = types
+        self.r, self.b = int((types == 0).sum()), int((types == 1).sum())
+        self.NE = False
+        self.rebuild_neighbor_counts(counts)
+        self.simulation_state = 0
+
+    # tables[t][c0, c1] = utility of a type t agent with c0 type-0 and c1 type-1 neighbors
+    def utility_tables(self):
+        return type_tables(self.utility_function.table())
+
     def set_utility_function(self, f):
         self.NE = False
         self.utility_function = f
     
     def set_self_inclusive(self, self_inclusive):
-        if self_inclusive != self.self_inclusive:
-            self.NE = False
+        if self_inclusive == self.self_inclusive:
+            return
+        self.NE = False
         self.self_inclusive = self_inclusive
+        self.rebuild_neighbor_counts()
 
     def set_torus_type(self, torus_type):
-        if torus_type == "8-Torus":
-            if self.diagonal_neighbors == False:
-                self.NE = False
-            self.diagonal_neighbors = True
-        else:
-            if self.diagonal_neighbors == True:
-                self.NE = False
-            self.diagonal_neighbors = False
+        diagonal_neighbors = torus_type == "8-Torus"
+        if diagonal_neighbors == self.diagonal_neighbors:
+            return
+        self.NE = False
+        self.diagonal_neighbors = diagonal_neighbors
+        self.rebuild_neighbor_counts()
 
     def set_blue_agents(self, blue_agents):
         if self.blue_agent_ratio == blue_agents:
@@ -121,11 +194,11 @@ class Game(ABC):
         self.generate_grid()
 
     @abstractmethod
-    def draw_on(self, screen, font):
+    def update_simulation(self):
         pass
 
     @abstractmethod
-    def update_simulation(self):
+    def step(self):
         pass
 
 
@@ -140,33 +213,50 @@ class JumpGame(Game):
         # assert r >= b
         self.NE = False
         nodes = list(self.positions())   
-        random.shuffle(nodes)
+        self.rng.shuffle(nodes)
         self.r = r
         self.b = b
         agent_counts = [r,b] # 0 is red, 1 is blue
+        self.types = np.full((self.width, self.height), EMPTY, dtype=np.int8)
         for agent_type, agent_count in enumerate(agent_counts): 
             for i in range(agent_count):
                 node = nodes.pop()
                 self.grid[node[0]][node[1]] = JumpAgent(self, agent_type, node)
+                self.types[node] = agent_type
 
     def generate_grid(self):
         self.NE = False
         self.grid = [[None for _ in range(self.height)] for _ in range(self.width)]
         self.place_agents(int(self.agent_count* (1-self.blue_agent_ratio)), int(self.agent_count * self.blue_agent_ratio))
+        self.rebuild_neighbor_counts()
         self.agents = [self.agent_at(pos) for pos in self.positions() if self.agent_at(pos) is not None]
         self.empty_nodes = set((pos for pos in self.positions() if self.agent_at(pos) is None))
         self.jump_target = None
         self.jumping_agent = None
         self.simulation_state = 0
-        self.ls = self.local_segregation(self.agents)
         print("Local Segregation: ", self.ls)
 
-    def __init__(self, width, height, utility_function = SinglePeakedUtility(peak = Fraction(1,2))):
-        super().__init__(width, height, utility_function)
+    def load_types(self, types, counts = None):
+        super().load_types(types, counts)
+        self.grid = [[None for _ in range(self.height)] for _ in range(self.width)]
+        for x, y in zip(*np.nonzero(types != EMPTY)):
+            pos = (int(x), int(y))
+            self.grid[pos[0]][pos[1]] = JumpAgent(self, int(types[pos]), pos)
+        self.agents = [self.agent_at(pos) for pos in self.positions() if self.agent_at(pos) is not None]
+        self.empty_nodes = set((pos for pos in self.positions() if self.agent_at(pos) is None))
+        self.agent_count = self.r + self.b
+        self.jump_target = None
+        self.jumping_agent = None
+
+    def __init__(self, width, height, utility_function = SinglePeakedUtility(peak = Fraction(1,2)), seed = None):
+        super().__init__(width, height, utility_function, seed)
         self.r = 1
         self.b = 1
         self.agent_ratio = 0.8
         self.agent_count = int(self.height*self.width*self.agent_ratio/2)
+        self.best_response = False # jump to a best target instead of any improving one
+        self.parallel = False # make many non-interfering jumps per step, see find_parallel_jumps
+        self.strip_pool = None # makes the parallel jumps on several cores, see strips.StripPool
         
         self.generate_grid()
         
@@ -175,88 +265,177 @@ class JumpGame(Game):
         self.jump_new_utility = None
         
     
-    def draw_on(self, screen, font):   
-        def blit_centered(screen, surface, center):
-            pos = (center[0] - surface.get_size()[0]/2, center[1] - surface.get_size()[1]/2)
-            screen.blit(surface, pos)
-        def grid_pos_to_coords(pos):
-            return ((pos[0])*self.size, (pos[1])*self.size)
-        def grid_pos_to_center(pos):
-            return ((pos[0]+0.5)*self.size, (pos[1]+0.5)*self.size)
-        def highlight_cell(pos, color, width):
-            pos = grid_pos_to_coords(pos)
-            pygame.draw.rect(screen, color, (pos[0], pos[1], self.size, self.size), width)
-        screen.fill((0, 0, 0))
-        for x in range(self.width):
-            for y in range(self.height):
-                agent_type = self.agent_type_at((x,y))
-                agent_surface = self.agent_mapping[agent_type]
-                screen.blit(agent_surface, grid_pos_to_coords((x,y)))
-        if self.jumping_agent is not None and self.jump_target is not None:
-            for pos in self.neighbors(self.jumping_agent.pos):
-                highlight_cell(pos, (200, 150, 150, 75), 2)
-            highlight_cell(self.jumping_agent.pos, (200, 200, 200), 4)
-            for pos in self.neighbors(self.jump_target):
-                highlight_cell(pos, (150, 200, 150, 75), 4)
-            highlight_cell(self.jump_target, (200, 200, 200), 2)
-            current_utility = self.jumping_agent.utility()
-            text_current_utility = font.render(str(float(int(current_utility*100)/100)), True, (0, 0, 0))
-            text_new_utility = font.render(str(float(int(self.jump_new_utility*100)/100)), True, (255, 255, 255))
-            blit_centered(screen, text_current_utility, grid_pos_to_center(self.jumping_agent.pos))
-            blit_centered(screen, text_new_utility, grid_pos_to_center(self.jump_target))
-    
     def update_simulation(self):
+        if self.parallel:
+            # parallel jumps are not highlighted one by one
+            self.step()
+            return
         if self.simulation_state == 0:
             self.jumping_agent, self.jump_target, self.jump_new_utility = self.find_jump()
             
         if self.simulation_state == 1:
             self.execute_jump()
         self.simulation_state = (self.simulation_state + 1 ) % 2
+
+    # finds and executes a jump in one go, returns False once a Nash equilibrium is reached
+    # and the number of jumps made when they are made in parallel
+    def step(self):
+        # best responses depend on all empty cells, so they are always made one at a time
+        if self.parallel and not self.best_response and not self.NE:
+            if self.strip_pool is not None:
+                moved = self.strip_pool.make_jumps()
+                if moved:
+                    return moved
+            jumps = self.find_parallel_jumps()
+            if jumps:
+                self.apply_jumps(jumps)
+                return len(jumps)
+        # the coloring can miss the last few improving jumps, the sequential search finds them or detects the NE
+        self.jumping_agent, self.jump_target, self.jump_new_utility = self.find_jump()
+        moved = self.jumping_agent is not None
+        self.execute_jump()
+        return moved
     
     def execute_jump(self):
         if self.jumping_agent and self.jump_target:
-            # updating local segregation metric
-            affected_neighbors = set()
-            affected_neighbors.add(self.jumping_agent)
-            for pos in self.neighbors(self.jumping_agent.pos):
-                if (neighbor := self.agent_at(pos)) is None: continue
-                affected_neighbors.add(neighbor)
-            for pos in self.neighbors(self.jump_target):
-                if (neighbor := self.agent_at(pos)) is None: continue
-                affected_neighbors.add(neighbor)
-
-            ls_pre_jump = self.local_segregation(affected_neighbors)
             self.jumping_agent.jump_to(self.jump_target)
-            ls_post_jump = self.local_segregation(affected_neighbors)
-            self.ls += (ls_post_jump - ls_pre_jump)
     
         self.jumping_agent = None
         self.jump_target = None
+
+    # Selects many improving jumps at once that can be made one after another in any order, see select_jumps.
+    # Returns a list of (origin, target) positions.
+    def find_parallel_jumps(self, rounds = 4):
+        if self.width < 2 or self.height < 2:
+            return []
+        rng = np.random.default_rng(self.rng.getrandbits(64))
+        jumps, evaluations = select_jumps(self.types, self.counts, self.utility_tables(), self.offsets, self.self_mult, rng, rounds)
+        self.evaluations += evaluations
+        return [(divmod(origin, self.height), divmod(target, self.height)) for origin, target in jumps]
+
+    def apply_jumps(self, jumps):
+        for origin, target in jumps:
+            self.agent_at(origin).jump_to(target)
             
     def find_jump(self):
         if self.NE:
             return None, None, None
-        limit = int(len(self.agents)*0.1)
-        empty_nodes = list(self.empty_nodes)
-        random.shuffle(empty_nodes)
-        for _ in range(limit):
-            agent = random.choice(self.agents)
-            improving_position, new_utility = agent.find_improving_jump(empty_nodes)
-            if improving_position:
-                return agent, improving_position, new_utility
-        random.shuffle(self.agents)
-        for agent in self.agents:
-            improving_position, new_utility = agent.find_improving_jump(empty_nodes)
+        if self.unhappy is None:
+            self.build_indexes()
+        while self.unhappy:
+            pos = self.unhappy.choice(self.rng)
+            agent = self.agent_at(pos)
+            improving_position, new_utility = self.find_target(agent)
             if improving_position:
                 return agent, improving_position, new_utility
+            self.unhappy.remove(pos)
+            self.complete_classes.discard(self.agent_classes.keys[pos])
         self.NE = True
         return None, None, None
 
+    # Picks a random improving target for the agent, or a random best response if self.best_response is set.
+    # Empty cells are grouped into buckets by neighborhood composition, so only the buckets and the empty cells
+    # next to the agent (where it would stop counting itself at its old position) need to be looked at.
+    def find_target(self, agent):
+        table = self.utility_tables()[agent.type]
+        u = agent.utility()
+        self_mult = self.link_count(agent.pos, agent.pos)
+        near = set(pos for pos in self.neighbors(agent.pos) if self.types[pos] == EMPTY)
+        options = [] # (new utility, number of cells, cell, bucket)
+        self.evaluations += len(near) + len(self.empty_buckets.members)
+        for pos in near:
+            new_utility = agent.utility_at(pos)
+            if is_greater(new_utility, u):
+                options.append((new_utility, 1, pos, None))
+        for key, members in self.empty_buckets.members.items():
+            counts = list(key)
+            counts[agent.type] += self_mult
+            new_utility = table[counts[0], counts[1]]
+            if not is_greater(new_utility, u):
+                continue
+            far = len(members) - sum(1 for pos in near if self.empty_buckets.keys[pos] == key)
+            if far > 0:
+                options.append((new_utility, far, None, key))
+        if not options:
+            return None, None
+        if self.best_response:
+            best = max(option[0] for option in options)
+            options = [option for option in options if not is_greater(best, option[0])]
+        r = self.rng.randrange(sum(option[1] for option in options))
+        for new_utility, count, pos, key in options:
+            if r < count:
+                break
+            r -= count
+        if pos is None:
+            members = self.empty_buckets.members[key]
+            pos = members.choice(self.rng)
+            while pos in near:
+                pos = members.choice(self.rng)
+        return pos, new_utility
+
+    # self.unhappy holds the positions of all agents that may have an improving jump (and possibly a few that
+    # do not, which find_jump drops when it picks them). Agents are grouped into classes by type and
+    # neighborhood composition, and a class is complete if all of its members are in self.unhappy.
+    def build_indexes(self):
+        agent_positions = self.agent_positions()
+        self.agent_classes = CompositionIndex()
+        for pos in agent_positions:
+            self.agent_classes.set(pos, self.composition_key(pos))
+        self.empty_buckets = CompositionIndex()
+        for pos in self.empty_positions():
+            self.empty_buckets.set(pos, self.composition_key(pos)[1:])
+        self.unhappy = RandomSet(agent_positions)
+        self.complete_classes = set()
+
+    def invalidate_indexes(self):
+        self.unhappy = None
+
+    def empty_positions(self):
+        return self.positions_where(self.types == EMPTY)
+
+    def composition_key(self, pos):
+        return (int(self.types[pos]), int(self.counts[(0,) + pos]), int(self.counts[(1,) + pos]))
+
+    def agent_moved(self, old_pos, new_pos):
+        if self.unhappy is None:
+            return
+        # agents whose neighborhood changed
+        touched = set(self.neighbors(old_pos) + self.neighbors(new_pos) + [old_pos, new_pos])
+        for pos in touched:
+            if self.types[pos] == EMPTY:
+                self.agent_classes.discard(pos)
+                self.unhappy.discard(pos)
+                self.empty_buckets.set(pos, self.composition_key(pos)[1:])
+            else:
+                self.empty_buckets.discard(pos)
+                self.agent_classes.set(pos, self.composition_key(pos))
+                self.unhappy.add(pos)
+
+        # agents that may now prefer one of the changed empty cells, with or without counting themselves there
+        tables = self.utility_tables()
+        self_mult = self.link_count(old_pos, old_pos)
+        thresholds = [-np.inf, -np.inf]
+        for pos in touched:
+            if self.types[pos] != EMPTY:
+                continue
+            counts = [int(self.counts[(0,) + pos]), int(self.counts[(1,) + pos])]
+            for agent_type in range(2):
+                for m in self.link_values:
+                    shifted = list(counts)
+                    shifted[agent_type] = max(counts[agent_type] + self_mult - m, 0)
+                    thresholds[agent_type] = max(thresholds[agent_type], tables[agent_type][shifted[0], shifted[1]])
+        for key in self.agent_classes.classes():
+            agent_type, c0, c1 = key
+            if key not in self.complete_classes and is_greater(thresholds[agent_type], tables[agent_type][c0, c1]):
+                for pos in self.agent_classes.members[key]:
+                    self.unhappy.add(pos)
+                self.complete_classes.add(key)
+
 class SwapGame(Game):
     
     
-    def __init__(self, width, height, utility_function = SinglePeakedUtility(peak = Fraction(1,2))):
-        super().__init__(width, height, utility_function)
+    def __init__(self, width, height, utility_function = SinglePeakedUtility(peak = Fraction(1,2)), seed = None):
+        super().__init__(width, height, utility_function, seed)
     
         self.b = int(self.width * self.height * self.blue_agent_ratio)
         self.r = self.width * self.height - self.b # no empty cells
@@ -265,100 +444,154 @@ class SwapGame(Game):
         self.swap_agent2 = None
 
 
-    def draw_on(self, screen, font):
-        def blit_centered(screen, surface, center):
-            pos = (center[0] - surface.get_size()[0]/2, center[1] - surface.get_size()[1]/2)
-            screen.blit(surface, pos)
-        def grid_pos_to_coords(pos):
-            return ((pos[0])*self.size, (pos[1])*self.size)
-        def grid_pos_to_center(pos):
-            return ((pos[0]+0.5)*self.size, (pos[1]+0.5)*self.size)
-        def highlight_cell(pos, color, width):
-            pos = grid_pos_to_coords(pos)
-            pygame.draw.rect(screen, color, (pos[0], pos[1], self.size, self.size), width)
-        screen.fill((0, 0, 0))
-        for x in range(self.width):
-            for y in range(self.height):
-                agent_type = self.agent_type_at((x,y))
-                agent_surface = self.agent_mapping[agent_type]
-                screen.blit(agent_surface, grid_pos_to_coords((x,y)))
-        if self.swap_agent1 is not None and self.swap_agent2 is not None:
-            for pos in self.neighbors(self.swap_agent1.pos):
-                highlight_cell(pos, (200, 150, 150, 75), 2)
-            highlight_cell(self.swap_agent1.pos, (200, 200, 200), 4)
-            for pos in self.neighbors(self.swap_agent2.pos):
-                highlight_cell(pos, (150, 200, 150, 75), 4)
-            highlight_cell(self.swap_agent2.pos, (200, 200, 200), 2)
-            # new_utility_a = self.jumping_agent.utility()
-            # text_current_utility = font.render(str(float(int(current_utility*100)/100)), True, (0, 0, 0))
-            # text_new_utility = font.render(str(float(int(self.jump_new_utility*100)/100)), True, (255, 255, 255))
-            # blit_centered(screen, text_current_utility, grid_pos_to_center(self.swap_agent1.pos))
-            # blit_centered(screen, text_new_utility, grid_pos_to_center(self.swap_agent2.pos))
-
-
     def place_agents(self, r, b):
         assert r+b == self.width*self.height
         nodes = list(self.positions())
-        random.shuffle(nodes)
+        self.rng.shuffle(nodes)
         assert len(nodes) == self.width*self.height
         self.r = r
         self.b = b
         self.NE = False
         agent_counts = [r,b] # 0 is red, 1 is blue
+        self.types = np.full((self.width, self.height), EMPTY, dtype=np.int8)
         for agent_type, agent_count in enumerate(agent_counts):
             for i in range(agent_count):
                 node = nodes.pop()
                 self.grid[node[0]][node[1]] = SwapAgent(self, agent_type, node)
+                self.types[node] = agent_type
 
     def generate_grid(self):
         self.NE = False
         self.grid = [[None for _ in range(self.height)] for _ in range(self.width)]
         num_blue = int(self.width * self.height * self.blue_agent_ratio)
         self.place_agents(self.width*self.height - num_blue, num_blue)
+        self.rebuild_neighbor_counts()
         self.blue_agents = [self.agent_at(pos) for pos in self.positions() if self.agent_type_at(pos) == 1]
         self.red_agents = [self.agent_at(pos) for pos in self.positions() if self.agent_type_at(pos) == 0]
         self.agents = self.red_agents + self.blue_agents
         self.simulation_state = 0
-        self.ls = self.local_segregation(self.agents)
         print("Local Segregation: ", self.ls)
 
+    def load_types(self, types, counts = None):
+        assert (types != EMPTY).all()
+        super().load_types(types, counts)
+        self.grid = [[None for _ in range(self.height)] for _ in range(self.width)]
+        for pos in self.positions():
+            self.grid[pos[0]][pos[1]] = SwapAgent(self, int(types[pos]), pos)
+        self.blue_agents = [self.agent_at(pos) for pos in self.positions() if self.agent_type_at(pos) == 1]
+        self.red_agents = [self.agent_at(pos) for pos in self.positions() if self.agent_type_at(pos) == 0]
+        self.agents = self.red_agents + self.blue_agents
+        self.swap_agent1 = None
+        self.swap_agent2 = None
+
     def agent_count(self):
         return int(self.height*self.width)
     
-    def wrap_position(self, pos):
-        return (pos[0] % self.width, pos[1] % self.height)
-    
-    def neighbors(self, pos):
-        return [self.wrap_position((pos[0]+i, pos[1]+j)) for i in range(-1,2) for j in range(-1,2) if self.adjacent(i,j)]
-
+    # When a blue and a red agent are not adjacent, their utilities after swapping only depend on the compositions of
+    # their own cells. Agents are therefore grouped into classes by type and composition and improving swaps are
+    # decided per pair of classes. Improving swaps between adjacent agents are tracked separately in
+    # self.adjacent_swaps and rechecked whenever a swap changes one of the two cells' neighborhoods.
     def find_swap(self):
         if self.NE:
             return None, None
-        # limit = int(len(self.agents)*0.1)
-        # random.shuffle(self.agents)
-        for agent in self.blue_agents:
-            improving_swap_partner = agent.find_improving_swap(self.red_agents)
-            if improving_swap_partner:
-                return agent, improving_swap_partner
-        self.NE = True
-        return None, None
+        if self.agent_classes is None:
+            self.build_indexes()
+        tables = self.utility_tables()
+        self_mult = self.link_count((0,0), (0,0))
+        classes = self.agent_classes.classes()
+        blue_classes = [key for key in classes if key[0] == 1]
+        red_classes = [key for key in classes if key[0] == 0]
+        options = [] # (number of pairs, blue class, red class)
+        for blue_key in blue_classes:
+            _, c0, c1 = blue_key
+            u_blue = tables[1][c0, c1]
+            red_new = tables[0][c0 + self_mult, c1 - self_mult]
+            for red_key in red_classes:
+                _, c0, c1 = red_key
+                u_red = tables[0][c0, c1]
+                blue_new = tables[1][c0 - self_mult, c1 + self_mult]
+                if is_greater(blue_new, u_blue) and is_greater(red_new, u_red) and self.has_distant_pair(blue_key, red_key):
+                    options.append((len(self.agent_classes.members[blue_key]) * len(self.agent_classes.members[red_key]), blue_key, red_key))
+        distant = sum(option[0] for option in options)
+        self.evaluations += len(blue_classes) * len(red_classes) + len(self.adjacent_swaps)
+        if distant + len(self.adjacent_swaps) == 0:
+            self.NE = True
+            return None, None
+        r = self.rng.randrange(distant + len(self.adjacent_swaps))
+        if r >= distant:
+            # each adjacent swap counts once, after the class pairs
+            blue_pos, red_pos = self.adjacent_swaps[r - distant]
+        else:
+            for count, blue_key, red_key in options:
+                if r < count:
+                    break
+                r -= count
+            blue_members, red_members = self.agent_classes.members[blue_key], self.agent_classes.members[red_key]
+            blue_pos, red_pos = blue_members.choice(self.rng), red_members.choice(self.rng)
+            while self.link_count(blue_pos, red_pos) > 0:
+                blue_pos, red_pos = blue_members.choice(self.rng), red_members.choice(self.rng)
+        return self.agent_at(blue_pos), self.agent_at(red_pos)
+
+    def has_distant_pair(self, blue_key, red_key):
+        blue_members, red_members = self.agent_classes.members[blue_key], self.agent_classes.members[red_key]
+        if len(blue_members) > self.neighborhood_size or len(red_members) > self.neighborhood_size:
+            return True
+        return any(self.link_count(blue_pos, red_pos) == 0 for blue_pos in blue_members for red_pos in red_members)
+
+    def build_indexes(self):
+        self.agent_classes = CompositionIndex()
+        self.adjacent_swaps = RandomSet()
+        for pos in self.agent_positions():
+            self.agent_classes.set(pos, self.composition_key(pos))
+        for pos in self.blue_positions():
+            self.update_adjacent_swaps(pos)
+
+    def invalidate_indexes(self):
+        self.agent_classes = None
+
+    def blue_positions(self):
+        return self.positions_where(self.types == 1)
+
+    def composition_key(self, pos):
+        return (int(self.types[pos]), int(self.counts[(0,) + pos]), int(self.counts[(1,) + pos]))
+
+    def update_adjacent_swaps(self, pos):
+        agent = self.agent_at(pos)
+        for neighbor_pos in set(self.neighbors(pos)):
+            self.adjacent_swaps.discard((pos, neighbor_pos))
+            self.adjacent_swaps.discard((neighbor_pos, pos))
+            other_agent = self.agent_at(neighbor_pos)
+            if other_agent.type != agent.type and agent.is_improving_swap(other_agent):
+                blue, red = (agent, other_agent) if agent.type == 1 else (other_agent, agent)
+                self.adjacent_swaps.add((blue.pos, red.pos))
+
+    def agents_swapped(self, pos1, pos2):
+        if self.agent_classes is None:
+            return
+        touched = set(self.neighbors(pos1) + self.neighbors(pos2) + [pos1, pos2])
+        for pos in touched:
+            self.agent_classes.set(pos, self.composition_key(pos))
+        for pos in touched:
+            self.update_adjacent_swaps(pos)
 
     def update_simulation(self):
         if self.simulation_state == 0:
             self.swap_agent1, self.swap_agent2 = self.find_swap()
 
         if self.simulation_state == 1:
-            if self.swap_agent1 and self.swap_agent2:
-                affected_neighbors = set()
-                for pos in self.neighbors(self.swap_agent1.pos):
-                    affected_neighbors.add(self.agent_at(pos))
-                for pos in self.neighbors(self.swap_agent2.pos):
-                    affected_neighbors.add(self.agent_at(pos))
-                ls_pre_swap = self.local_segregation(affected_neighbors)
-                SwapAgent.swap(self, self.swap_agent1, self.swap_agent2)
-                ls_post_swap = self.local_segregation(affected_neighbors)
-                self.ls += (ls_post_swap - ls_pre_swap)
+            self.execute_swap()
         
         self.simulation_state = (self.simulation_state + 1 ) % 2
+
+    # finds and executes a swap in one go, returns False once a Nash equilibrium is reached
+    def step(self):
+        self.swap_agent1, self.swap_agent2 = self.find_swap()
+        moved = self.swap_agent1 is not None
+        self.execute_swap()
+        return moved
+
+    def execute_swap(self):
+        if self.swap_agent1 and self.swap_agent2:
+            SwapAgent.swap(self, self.swap_agent1, self.swap_agent2)
     
         
\ No newline at end of file
@@ -0,0 +1,150 @@
+import argparse
+import csv
+import json
+import os
+import time
+from fractions import Fraction
+from game import JumpGame, SwapGame
+from array_game import ArrayJumpGame, ArraySwapGame
+from movelog import MoveLogWriter
+from snapshot import save_snapshot, load_snapshot
+from profiler import Profiler
+from strips import StripPool
+from utilities import *
+
+# Runs a game without pygame until it reaches a Nash equilibrium or a move/time budget runs out,
+# e.g. python headless.py --mode jump --width 200 --height 200 --utility tau --tau 0.5 --output run.json
+
+GAME_CLASSES = {
+    ("jump", "object"): JumpGame,
+    ("jump", "array"): ArrayJumpGame,
+    ("swap", "object"): SwapGame,
+    ("swap", "array"): ArraySwapGame,
+}
+
+UTILITIES = ["single-peaked", "tau", "tau-no-seg", "trapezoid", "rectangle", "custom"]
+
+def make_utility(name, peak = Fraction(1,2), tau = Fraction(1,2), l = 0.25, r = 0.75, custom = "min(frac, 0.5)"):
+    if name == "single-peaked":
+        return SinglePeakedUtility(peak)
+    if name == "tau":
+        return TauUtility(tau)
+    if name == "tau-no-seg":
+        return TauNoSegUtility(tau)
+    if name == "trapezoid":
+        return TrapezoidalUtility(l, r)
+    if name == "rectangle":
+        return RectangularUtility(l, r)
+    if name == "custom":
+        return CustomUtility(custom)
+    raise ValueError(name)
+
+def make_game(mode, engine, width, height, utility, density = 0.8, blue = 0.5, torus = "8-Torus", self_inclusive = True, seed = None):
+    # like load_snapshot, a 1x1 board keeps the constructor from generating a full board, so the board is placed and
+    # counted only once, with all settings in place
+    game = GAME_CLASSES[mode, engine](1, 1, utility, seed)
+    game.width, game.height = width, height
+    game.diagonal_neighbors = torus == "8-Torus"
+    game.self_inclusive = self_inclusive
+    game.blue_agent_ratio = blue
+    if mode == "jump":
+        game.agent_ratio = density
+        game.agent_count = int(width*height*density)
+    game.generate_grid()
+    return game
+
+def run(game, max_moves = None, time_limit = None):
+    start = time.perf_counter()
+    moves = 0
+    while max_moves is None or moves < max_moves:
+        if time_limit is not None and time.perf_counter() - start >= time_limit:
+            break
+        moved = game.step()
+        if not moved:
+            break
+        moves += moved
+    seconds = time.perf_counter() - start
+    return {"moves": moves, "NE": game.NE, "ls": game.ls, "seconds": seconds,
+            "moves_per_second": moves / seconds if seconds > 0 else 0.0}
+
+def write_results(path, rows):
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2)
+        return
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rows)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a Schelling game without a window")
+    parser.add_argument("--mode", choices=["jump", "swap"], default="jump")
+    parser.add_argument("--engine", choices=["object", "array"], default="object")
+    parser.add_argument("--width", type=int, default=25)
+    parser.add_argument("--height", type=int, default=25)
+    parser.add_argument("--density", type=float, default=0.8, help="fraction of occupied cells (jump mode)")
+    parser.add_argument("--blue", type=float, default=0.5, help="fraction of blue agents")
+    parser.add_argument("--torus", choices=["8-Torus", "4-Torus"], default="8-Torus")
+    parser.add_argument("--self-exclusive", action="store_true")
+    parser.add_argument("--utility", choices=UTILITIES, default="single-peaked")
+    parser.add_argument("--peak", type=Fraction, default=Fraction(1,2))
+    parser.add_argument("--tau", type=Fraction, default=Fraction(1,2))
+    parser.add_argument("--l", type=float, default=0.25)
+    parser.add_argument("--r", type=float, default=0.75)
+    parser.add_argument("--custom", default="min(frac, 0.5)")
+    parser.add_argument("--parallel", action="store_true", help="make many non-interfering jumps per step (jump mode)")
+    parser.add_argument("--workers", type=int, default=None, help="make the parallel jumps on this many processes, one strip of the board each (array engine, implies --parallel)")
+    parser.add_argument("--max-moves", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help=".csv (appended) or .json file")
+    parser.add_argument("--log", default=None, help="record every move to this binary move log")
+    parser.add_argument("--load", default=None, help="start from this snapshot (.npz) or type grid (.npy) instead of a random board")
+    parser.add_argument("--save", default=None, help="save a snapshot (.npz) of the final state")
+    parser.add_argument("--profile", default=None, help="write the time spent per game method and the move and evaluation rates to this .json file")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    utility = make_utility(args.utility, args.peak, args.tau, args.l, args.r, args.custom)
+    start = time.perf_counter()
+    if args.load:
+        game = load_snapshot(args.load, args.engine)
+        args.mode = "jump" if isinstance(game, JumpGame) else "swap"
+        args.width, args.height = game.width, game.height
+    else:
+        game = make_game(args.mode, args.engine, args.width, args.height, utility, args.density, args.blue,
+                         args.torus, not args.self_exclusive, args.seed)
+    setup_seconds = time.perf_counter() - start
+    if (args.parallel or args.workers) and isinstance(game, JumpGame):
+        game.parallel = True
+    strip_pool = StripPool(game, args.workers) if args.workers and isinstance(game, ArrayJumpGame) else None
+    move_log = MoveLogWriter(args.log, game) if args.log else None
+    profiler = Profiler()
+    if args.profile:
+        profiler.enable(game, *([(strip_pool, ["make_jumps"], "strips.")] if strip_pool else []))
+    result = run(game, args.max_moves, args.time_limit)
+    if args.profile:
+        with open(args.profile, "w") as f:
+            json.dump(profiler.report(), f, indent=2)
+        profiler.disable()
+    if strip_pool:
+        strip_pool.close()
+    if move_log:
+        move_log.close()
+    if args.save:
+        save_snapshot(game, args.save)
+    row = {"mode": args.mode, "engine": args.engine, "width": args.width, "height": args.height,
+           "density": args.density, "blue": args.blue, "torus": args.torus, "self_inclusive": not args.self_exclusive,
+           "utility": args.utility, "peak": str(args.peak), "tau": str(args.tau), "l": args.l, "r": args.r,
+           "custom": args.custom, "seed": args.seed, "setup_seconds": setup_seconds}
+    row.update(result)
+    print(json.dumps(row))
+    if args.output:
+        write_results(args.output, [row])
+
+if __name__ == '__main__':
+    main()
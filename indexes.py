@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+# A set supporting O(1) add, remove and uniform random choice. Iteration order only depends on the
+# order of insertions and removals, so seeded runs stay reproducible.
+class RandomSet:
+    def __init__(self, items = ()):
+        self.items = []
+        self.index = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item in self.index:
+            return
+        self.index[item] = len(self.items)
+        self.items.append(item)
+
+    def remove(self, item):
+        i = self.index.pop(item)
+        last = self.items.pop()
+        if i < len(self.items):
+            self.items[i] = last
+            self.index[last] = i
+
+    def discard(self, item):
+        if item in self.index:
+            self.remove(item)
+
+    def choice(self, rng):
+        return self.items[rng.randrange(len(self.items))]
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+# Groups cells by a key describing their neighborhood composition.
+class CompositionIndex:
+    def __init__(self):
+        self.members = defaultdict(RandomSet)
+        self.keys = {}
+
+    def set(self, pos, key):
+        old_key = self.keys.get(pos)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self.remove(pos)
+        self.keys[pos] = key
+        self.members[key].add(pos)
+
+    def remove(self, pos):
+        key = self.keys.pop(pos)
+        self.members[key].remove(pos)
+        if len(self.members[key]) == 0:
+            del self.members[key]
+
+    def discard(self, pos):
+        if pos in self.keys:
+            self.remove(pos)
+
+    def classes(self):
+        return list(self.members.keys())
@@ -4,8 +4,13 @@ import pygame_gui
 import sys
 from fractions import Fraction
 from game import *
+from array_game import ArrayJumpGame, ArraySwapGame
 from utilities import *
 from ui import *
+from render import GameRenderer
+from movelog import MoveLogWriter, Replay
+from simulation import SimulationThread
+from profiler import Profiler
 
 import random
 import numpy as np 
@@ -67,7 +72,16 @@ def select_mode_popup(manager, screen, clock, w_width, w_height):
     return mode
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Schelling Simulator")
+    parser.add_argument("--engine", choices=["object", "array"], default="object",
+                        help="object: grid of Agent objects, array: NumPy type array for large boards")
+    parser.add_argument("--record", default=None, help="record every move to this binary move log")
+    parser.add_argument("--replay", default=None, help="play back a move log; arrow keys step, page up/down, home and end seek")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     pygame.init()
     infoObject = pygame.display.Info()
     w_width, w_height = infoObject.current_w, infoObject.current_h
@@ -78,14 +92,22 @@ def main():
 
     manager = pygame_gui.UIManager((w_width, w_height))
 
-    mode = select_mode_popup(manager, screen, clock, w_width, w_height)
+    replay = Replay(args.replay) if args.replay else None
+    if replay:
+        mode = "Jump" if replay.log.config["mode"] == "jump" else "Swap"
+    else:
+        mode = select_mode_popup(manager, screen, clock, w_width, w_height)
 
     utility = SinglePeakedUtility(Fraction(1, 2))
 
-    if mode == "Jump":
-        game = JumpGame(25, 25, utility)
+    if replay:
+        game = replay.game
+    elif mode == "Jump":
+        game_class = ArrayJumpGame if args.engine == "array" else JumpGame
+        game = game_class(25, 25, utility)
     elif mode == "Swap":
-        game = SwapGame(15, 15, utility)
+        game_class = ArraySwapGame if args.engine == "array" else SwapGame
+        game = game_class(15, 15, utility)
     else:
         error_message = "No mode selected"
         print(error_message)
@@ -93,10 +115,12 @@ def main():
 
 
     pygame.display.set_caption(f'{mode} Schelling Simulator')
+    move_log = MoveLogWriter(args.record, game) if args.record else None
 
 
 
-    game.adapt_to_windowsize(w_width, w_height)
+    renderer = GameRenderer(game)
+    renderer.adapt_to_windowsize(w_width, w_height)
         
     ui_window_width, ui_window_height = 640, 640
     ui_window_x = (w_width - ui_window_width)
@@ -109,7 +133,8 @@ def main():
     graph_window_y = graph_window_margin_top
     graph_window_rect = pygame.Rect((graph_window_x, graph_window_y), (graph_window_width, graph_window_height))
 
-    ui_window = SettingsWindow(ui_window_rect, manager, game)
+    # the settings would regenerate the board, so a replay only shows the graphs
+    ui_window = SettingsWindow(ui_window_rect, manager, game) if not replay else None
     utility_window = GraphWindow(graph_window_rect, manager, game)
 
     metrics_window_width, metrics_window_height = 300, 150
@@ -119,48 +144,76 @@ def main():
     metrics_window_rect = pygame.Rect((metrics_window_x, metrics_window_y), (metrics_window_width, metrics_window_height))
 
     metrics_window = MetricsWindow(metrics_window_rect, manager, game)
+
+    # F3 toggles the profiler and its overlay
+    profiler = Profiler()
+    profiler_window_rect = metrics_window_rect.move(-(10 + metrics_window_width), 0)
+    profiler_window_rect.height = 250
+    profiler_window = ProfilerWindow(profiler_window_rect, manager, profiler)
+    profiler_window.hide()
     running = True
-    paused = False
-    simulation_speed = 1 # simulation ticks per second.
-    ms_per_simulation_tick = 1000/simulation_speed
-    elapsed_time_since_last_sim = 0.0
+    simulation = SimulationThread(replay if replay else game, speed = 1 if not replay else 60) # simulation ticks per second.
+    simulation.start()
     while running:
         time_delta_ms = clock.tick(60)
         time_delta_s = time_delta_ms/1000.0
-        if not paused:
-            elapsed_time_since_last_sim += time_delta_ms
-        simulate = False
-        if elapsed_time_since_last_sim >= ms_per_simulation_tick:
-            elapsed_time_since_last_sim -= ms_per_simulation_tick
-            simulate = True
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.VIDEORESIZE:
-                w_width, w_height = event.dict["size"]
-                screen = pygame.display.set_mode((w_width, w_height), pygame.RESIZABLE)
-                game.adapt_to_windowsize(w_width, w_height)
-                manager.set_window_resolution((w_width, w_height))
+        profiler.frame(time_delta_s)
+        # the simulation thread waits while the frame reads and changes the game
+        with profiler.phase("lock wait"):
+            simulation.lock.acquire()
+        with profiler.phase("events"):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.VIDEORESIZE:
+                    w_width, w_height = event.dict["size"]
+                    screen = pygame.display.set_mode((w_width, w_height), pygame.RESIZABLE)
+                    renderer.adapt_to_windowsize(w_width, w_height)
+                    manager.set_window_resolution((w_width, w_height))
+                elif event.type == pygame.KEYDOWN and replay:
+                    seek_step = max(1, replay.log.move_count // 100)
+                    seek_to = {pygame.K_RIGHT: replay.move + 1, pygame.K_LEFT: replay.move - 1,
+                               pygame.K_PAGEUP: replay.move + seek_step, pygame.K_PAGEDOWN: replay.move - seek_step,
+                               pygame.K_HOME: 0, pygame.K_END: replay.log.move_count}
+                    if event.key in seek_to:
+                        replay.seek(seek_to[event.key])
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    if profiler.enabled:
+                        profiler.disable()
+                        profiler_window.hide()
+                    else:
+                        profiler.enable(game, *([(ui_window, ["update"], "SettingsWindow.")] if ui_window else []))
+                        profiler_window.show()
             
-            ui_window.callback_manager.handle_event(event)
-            if event.type == pygame_gui.UI_HORIZONTAL_SLIDER_MOVED:
-                if event.ui_element == ui_window.properties["Simulation Speed"].slider:                
-                    simulation_speed = ui_window.properties["Simulation Speed"].get_value()
-                    paused = (simulation_speed == 0)
-                    if not paused:
-                        ms_per_simulation_tick = 1000/simulation_speed
-                    elapsed_time_since_last_sim = 0.0
-            manager.process_events(event)
-
-        manager.update(time_delta_s)
-        if simulate:
-            game.update_simulation()
-        game.draw_on(screen, font)
+                if ui_window:
+                    ui_window.callback_manager.handle_event(event)
+                if not manager.process_events(event):
+                    over_window = any(window.visible and window.rect.collidepoint(pygame.mouse.get_pos()) for window in manager.get_root_container().elements)
+                    if not (over_window and event.type in (pygame.MOUSEWHEEL, pygame.MOUSEBUTTONDOWN)):
+                        renderer.handle_event(event)
+
+        with profiler.phase("manager.update"):
+            manager.update(time_delta_s)
+        if ui_window:
+            turbo = ui_window.properties["Simulation Mode"].get_value() == "Turbo"
+            speed = ui_window.properties["Simulation Speed"].get_value()
+            if turbo and speed != 0:
+                speed = ui_window.properties["Turbo Moves/s"].get_value() or None
+            simulation.set_speed(speed, turbo)
+        windows = [window.rect for window in manager.get_root_container().elements if window.visible]
+        with profiler.phase("draw_on"):
+            dirty = renderer.draw_on(screen, font, windows)
+        simulation.lock.release()
         
-        manager.draw_ui(screen)
+        with profiler.phase("draw_ui"):
+            manager.draw_ui(screen)
         
-        pygame.display.update()
+        with profiler.phase("display.update"):
+            pygame.display.update(dirty + windows)
         
+    simulation.stop()
+    if move_log:
+        move_log.close()
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,93 @@
+import numpy as np
+
+# Records a metric (LS(G)) after every move of a game, with bounded memory for arbitrarily long runs.
+# Level 0 keeps the exact values of the most recent `capacity` samples. Level k >= 1 keeps the minimum and maximum
+# of every block of 2**k samples, again for the most recent `capacity` blocks, so older parts of the run are only
+# available at coarser resolutions. A 10^8 move run needs 27 levels, i.e. about 27 * capacity * 16 bytes.
+# New samples are folded into the coarser levels in batches, so recording stays cheap enough to do on every move.
+class MetricsHistory:
+    def __init__(self, capacity = 8192, fold_size = 1024):
+        assert capacity & (capacity - 1) == 0 and fold_size <= capacity // 2
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.fold_size = fold_size
+        self.exact = np.zeros(capacity)
+        self.mins = [] # mins[k-1], maxs[k-1] hold level k
+        self.maxs = []
+        self.count = 0 # samples recorded
+        self.folded = 0 # samples folded into the coarser levels
+        self.game = None
+
+    # samples game.ls after every move and whenever the board is replaced
+    def attach(self, game):
+        if self.game is not None:
+            self.game.metrics = None
+        self.game = game
+        game.metrics = self
+        self.record(game.ls)
+
+    def record(self, value):
+        self.exact[self.count & self.mask] = value
+        self.count += 1
+        if self.count - self.folded >= self.fold_size:
+            self.fold()
+
+    # computes the blocks completed since the last fold, level by level from the one below
+    def fold(self):
+        old, new = self.folded, self.count
+        below_min = below_max = self.exact
+        k = 1
+        while new >> k > old >> k:
+            if len(self.mins) < k:
+                self.mins.append(np.zeros(self.capacity))
+                self.maxs.append(np.zeros(self.capacity))
+            blocks = np.arange(old >> k, new >> k)
+            first, second = (2*blocks) & self.mask, (2*blocks + 1) & self.mask
+            self.mins[k-1][blocks & self.mask] = np.minimum(below_min[first], below_min[second])
+            self.maxs[k-1][blocks & self.mask] = np.maximum(below_max[first], below_max[second])
+            below_min, below_max = self.mins[k-1], self.maxs[k-1]
+            k += 1
+        self.folded = new
+
+    # finest level that still holds the block containing sample `start` and needs at most 2 * columns blocks
+    # for the rest of the run
+    def level_for(self, start, columns):
+        k = 0
+        while k < len(self.mins) and (((self.count >> k) - (start >> k) > 2 * columns) or
+                                      (self.count >> k) - self.capacity > start >> k):
+            k += 1
+        return k
+
+    # block of level j, min and max are the same value on level 0
+    def block(self, j, i):
+        if j == 0:
+            return self.exact[i & self.mask], self.exact[i & self.mask]
+        return self.mins[j-1][i & self.mask], self.maxs[j-1][i & self.mask]
+
+    # Minimum and maximum of the most recent `span` samples (the whole run by default) in at most `columns`
+    # equally sized columns, in time independent of the length of the run.
+    def envelope(self, span = None, columns = 256):
+        if self.count == 0:
+            return np.empty(0), np.empty(0)
+        if self.count > self.folded:
+            self.fold()
+        start = 0 if span is None else max(0, self.count - span)
+        k = self.level_for(start, columns)
+        blocks = np.arange(start >> k, self.count >> k)
+        if k == 0:
+            mins = maxs = self.exact[blocks & self.mask]
+        else:
+            mins, maxs = self.mins[k-1][blocks & self.mask], self.maxs[k-1][blocks & self.mask]
+        if self.count & ((1 << k) - 1):
+            # the samples after the last complete block of level k are the last complete block of every
+            # level j < k whose bit is set in count
+            tail = [self.block(j, (self.count >> j) - 1) for j in range(k) if self.count >> j & 1]
+            mins = np.append(mins, min(low for low, _ in tail))
+            maxs = np.append(maxs, max(high for _, high in tail))
+        if len(mins) > columns:
+            bounds = np.arange(columns) * len(mins) // columns
+            mins, maxs = np.minimum.reduceat(mins, bounds), np.maximum.reduceat(maxs, bounds)
+        return mins, maxs
+
+    def latest(self):
+        return self.exact[(self.count - 1) & self.mask] if self.count else 0.0
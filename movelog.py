@@ -0,0 +1,224 @@
+import argparse
+import bisect
+import json
+import os
+import struct
+import time
+import numpy as np
+from board import EMPTY
+from game import JumpGame
+from array_game import ArrayJumpGame, ArraySwapGame
+from utilities import utility_to_dict, utility_from_dict
+
+# Binary move log of a run:
+#   MAGIC, uint32 header length, JSON header (mode and utility)
+#   followed by records, each starting with a one byte tag:
+#   b"M" uint32 n, n moves as int32 pairs of flat cell indices (x*height + y). A jump moves the agent from the
+#        first cell to the second, a swap exchanges both cells, so replaying either one swaps the two cells.
+#   b"K" int64 move, int32 width, int32 height, uint8 diagonal_neighbors, uint8 self_inclusive, int8 types[width*height]
+#        the board after that many moves. The first keyframe holds the initial board; new ones are written
+#        periodically (at the end of a batch of parallel jumps that crosses the interval) and whenever the board is
+#        regenerated or the neighborhood changes.
+# Integers are little endian.
+
+MAGIC = b"SCHELLOG"
+KEYFRAME = struct.Struct("<qiiBB")
+
+class MoveLogWriter:
+    def __init__(self, path, game, keyframe_interval = 100000, buffer_size = 65536):
+        self.file = open(path, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.buffer = np.empty((buffer_size, 2), dtype=np.int32)
+        self.buffered = 0
+        self.moves = 0
+        self.game = game
+        header = json.dumps({"mode": "jump" if isinstance(game, JumpGame) else "swap",
+                             "utility": utility_to_dict(game.utility_function)}).encode()
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        self.keyframe(game)
+        game.move_log = self
+
+    def record(self, cell1, cell2):
+        self.add(cell1, cell2)
+        if self.moves % self.keyframe_interval == 0:
+            self.keyframe(self.game)
+
+    # Moves made all at once, e.g. parallel jumps, recorded after the game made them: the board only matches the
+    # move count again at the end of the batch, so a keyframe that falls due inside it is written there.
+    def record_batch(self, moves):
+        start = self.moves
+        for cell1, cell2 in moves:
+            self.add(cell1, cell2)
+        if self.moves // self.keyframe_interval > start // self.keyframe_interval:
+            self.keyframe(self.game)
+
+    def add(self, cell1, cell2):
+        self.buffer[self.buffered] = cell1, cell2
+        self.buffered += 1
+        self.moves += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def keyframe(self, game):
+        self.flush()
+        self.file.write(b"K" + KEYFRAME.pack(self.moves, game.width, game.height, game.diagonal_neighbors, game.self_inclusive))
+        self.file.write(np.ascontiguousarray(game.types, dtype=np.int8).tobytes())
+
+    def flush(self):
+        if self.buffered:
+            self.file.write(b"M" + struct.pack("<I", self.buffered) + self.buffer[:self.buffered].tobytes())
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.game.move_log is self:
+            self.game.move_log = None
+
+class MoveLogReader:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a move log")
+        header_length, = struct.unpack("<I", self.file.read(4))
+        self.config = json.loads(self.file.read(header_length))
+        self.chunk_starts = [] # index of the first move in each chunk
+        self.chunks = [] # (number of moves, file offset)
+        self.keyframe_moves = []
+        self.keyframe_offsets = []
+        self.move_count = 0
+        self.scan(os.path.getsize(path))
+
+    # indexes the records; a record cut off by an interrupted run ends the log
+    def scan(self, size):
+        while True:
+            offset = self.file.tell()
+            tag = self.file.read(1)
+            if tag == b"M":
+                data = self.file.read(4)
+                if len(data) < 4: break
+                n, = struct.unpack("<I", data)
+                if offset + 5 + 8*n > size: break
+                self.chunk_starts.append(self.move_count)
+                self.chunks.append((n, offset + 5))
+                self.move_count += n
+                self.file.seek(8*n, 1)
+            elif tag == b"K":
+                data = self.file.read(KEYFRAME.size)
+                if len(data) < KEYFRAME.size: break
+                move, width, height, _, _ = KEYFRAME.unpack(data)
+                if offset + 1 + KEYFRAME.size + width*height > size: break
+                self.keyframe_moves.append(move)
+                self.keyframe_offsets.append(offset + 1)
+                self.file.seek(width*height, 1)
+            else:
+                break
+
+    # returns (move, types, diagonal_neighbors, self_inclusive) of the i-th keyframe
+    def keyframe(self, i):
+        self.file.seek(self.keyframe_offsets[i])
+        move, width, height, diagonal_neighbors, self_inclusive = KEYFRAME.unpack(self.file.read(KEYFRAME.size))
+        types = np.frombuffer(self.file.read(width*height), dtype=np.int8).reshape((width, height))
+        return move, types, bool(diagonal_neighbors), bool(self_inclusive)
+
+    # index of the last keyframe written at or before the given move
+    def keyframe_before(self, move):
+        return bisect.bisect_right(self.keyframe_moves, move) - 1
+
+    # moves [start, stop) as an int32 array of cell pairs
+    def moves(self, start, stop):
+        stop = min(stop, self.move_count)
+        parts = []
+        i = bisect.bisect_right(self.chunk_starts, start) - 1
+        while start < stop:
+            n, offset = self.chunks[i]
+            first = start - self.chunk_starts[i]
+            count = min(n - first, stop - start)
+            self.file.seek(offset + 8*first)
+            parts.append(np.frombuffer(self.file.read(8*count), dtype=np.int32).reshape((count, 2)))
+            start += count
+            i += 1
+        if not parts:
+            return np.empty((0, 2), dtype=np.int32)
+        return np.concatenate(parts)
+
+    # board after the given number of moves, from the closest keyframe instead of the start of the run
+    def board_at(self, move):
+        keyframe_move, types, diagonal_neighbors, self_inclusive = self.keyframe(self.keyframe_before(move))
+        cells = types.ravel().tolist()
+        for cell1, cell2 in self.moves(keyframe_move, move).tolist():
+            cells[cell1], cells[cell2] = cells[cell2], cells[cell1]
+        return np.array(cells, dtype=np.int8).reshape(types.shape), diagonal_neighbors, self_inclusive
+
+    def close(self):
+        self.file.close()
+
+# Plays a move log back on an array game, which the GUI can draw like any other game.
+class Replay:
+    def __init__(self, path, block_size = 4096):
+        self.log = MoveLogReader(path)
+        game_class = ArrayJumpGame if self.log.config["mode"] == "jump" else ArraySwapGame
+        types, _, _ = self.log.board_at(0)
+        self.game = game_class(types.shape[0], types.shape[1], utility_from_dict(self.log.config["utility"]))
+        self.block_size = block_size
+        self.seek(0)
+
+    def seek(self, move):
+        self.move = max(0, min(move, self.log.move_count))
+        types, diagonal_neighbors, self_inclusive = self.log.board_at(self.move)
+        self.load(types, diagonal_neighbors, self_inclusive)
+        self.block = self.log.moves(self.move, self.move + self.block_size)
+        self.block_start = self.move
+
+    def load(self, types, diagonal_neighbors, self_inclusive):
+        self.game.diagonal_neighbors = diagonal_neighbors
+        self.game.self_inclusive = self_inclusive
+        self.game.load_types(types)
+
+    # applies the next move, returns False at the end of the log
+    def step(self):
+        if self.move >= self.log.move_count:
+            return False
+        if self.move - self.block_start >= len(self.block):
+            self.block = self.log.moves(self.move, self.move + self.block_size)
+            self.block_start = self.move
+        cell1, cell2 = (int(cell) for cell in self.block[self.move - self.block_start])
+        pos1, pos2 = divmod(cell1, self.game.height), divmod(cell2, self.game.height)
+        if self.game.types[pos2] == EMPTY:
+            self.game.move_type(pos1, pos2)
+        else:
+            self.game.swap_types(pos1, pos2)
+        self.move += 1
+        # the board was regenerated or the neighborhood changed here
+        i = self.log.keyframe_before(self.move)
+        if self.log.keyframe_moves[i] == self.move:
+            _, types, diagonal_neighbors, self_inclusive = self.log.keyframe(i)
+            if (types.shape != self.game.types.shape or diagonal_neighbors != self.game.diagonal_neighbors or
+                    self_inclusive != self.game.self_inclusive or not np.array_equal(types, self.game.types)):
+                self.load(types.copy(), diagonal_neighbors, self_inclusive)
+        return True
+
+    def update_simulation(self):
+        self.step()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay a move log without a window")
+    parser.add_argument("log")
+    parser.add_argument("--seek", type=int, default=None, help="jump to this move instead of replaying the whole log")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.perf_counter()
+    replay = Replay(args.log)
+    if args.seek is not None:
+        replay.seek(args.seek)
+    else:
+        while replay.step():
+            pass
+    seconds = time.perf_counter() - start
+    print(json.dumps({"moves": replay.log.move_count, "keyframes": len(replay.log.keyframe_moves),
+                      "position": replay.move, "ls": replay.game.ls, "seconds": seconds}))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import contextlib
+import time
+from collections import defaultdict, deque
+import numpy as np
+
+# Times the phases of the main loop and the game methods that find and execute moves.
+# While disabled nothing is instrumented: game methods are only wrapped by enable(), phase() hands out a
+# shared no-op context and frame() returns right away, so leaving the calls in the main loop costs next to nothing.
+GAME_METHODS = ["find_jump", "execute_jump", "find_swap", "execute_swap", "find_parallel_jumps", "apply_jumps",
+                "build_indexes", "generate_grid"]
+# number of moves a call of these methods found
+FOUND_MOVES = {"find_jump": lambda result: result[0] is not None,
+               "find_swap": lambda result: result[0] is not None,
+               "find_parallel_jumps": len,
+               "make_jumps": lambda moves: moves}
+
+class Profiler:
+    def __init__(self, frames = 600):
+        self.enabled = False
+        self.game = None
+        self.instrumented = []
+        self.frame_times = deque(maxlen=frames)
+        self.reset()
+
+    def reset(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.moves = 0
+        self.start = time.perf_counter()
+        self.evaluations_start = self.game.evaluations if self.game else 0
+        self.frame_times.clear()
+        self.last = None
+
+    def enable(self, game, *others):
+        if self.enabled:
+            self.disable()
+        self.enabled = True
+        self.game = game
+        self.reset()
+        self.instrument(game, GAME_METHODS)
+        for obj, names, prefix in others:
+            self.instrument(obj, names, prefix)
+
+    def disable(self):
+        for obj, name in self.instrumented:
+            delattr(obj, name)
+        self.instrumented = []
+        self.enabled = False
+
+    # replaces the methods by timed ones on the instance only, disable() uncovers the class methods again
+    def instrument(self, obj, names, prefix = ""):
+        for name in names:
+            method = getattr(obj, name, None)
+            if method is None:
+                continue
+            setattr(obj, name, self.timed(prefix + name, method, FOUND_MOVES.get(name)))
+            self.instrumented.append((obj, name))
+
+    def timed(self, label, method, found_moves = None):
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                self.seconds[label] += time.perf_counter() - start
+                self.calls[label] += 1
+            if found_moves is not None:
+                self.moves += found_moves(result)
+            return result
+        return timed_method
+
+    @contextlib.contextmanager
+    def timed_phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def phase(self, name):
+        return self.timed_phase(name) if self.enabled else NO_PHASE
+
+    def frame(self, seconds):
+        if self.enabled:
+            self.frame_times.append(seconds)
+
+    # totals since enable() or reset()
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        evaluations = (self.game.evaluations if self.game else 0) - self.evaluations_start
+        report = {"seconds": elapsed, "moves": self.moves, "evaluations": evaluations,
+                  "moves_per_second": self.moves / elapsed if elapsed > 0 else 0.0,
+                  "evaluations_per_second": evaluations / elapsed if elapsed > 0 else 0.0,
+                  "phases": {name: {"calls": self.calls[name], "seconds": seconds,
+                                    "ms_per_call": 1000 * seconds / self.calls[name] if self.calls[name] else 0.0,
+                                    "share": seconds / elapsed if elapsed > 0 else 0.0}
+                             for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])}}
+        if self.frame_times:
+            p50, p90, p99 = (float(p) for p in np.percentile(np.array(self.frame_times) * 1000, [50, 90, 99]))
+            report["frame_ms"] = {"p50": p50, "p90": p90, "p99": p99, "max": 1000 * max(self.frame_times)}
+        return report
+
+    # rates and phase shares since the previous call, for the overlay
+    def interval(self):
+        report = self.report()
+        last, self.last = self.last, report
+        if last is None:
+            return report
+        elapsed = report["seconds"] - last["seconds"]
+        if elapsed <= 0:
+            return report
+        interval = dict(report)
+        interval["moves_per_second"] = (report["moves"] - last["moves"]) / elapsed
+        interval["evaluations_per_second"] = (report["evaluations"] - last["evaluations"]) / elapsed
+        interval["phases"] = {}
+        for name, phase in report["phases"].items():
+            before = last["phases"].get(name, {"calls": 0, "seconds": 0.0})
+            calls, seconds = phase["calls"] - before["calls"], phase["seconds"] - before["seconds"]
+            interval["phases"][name] = {"calls": calls, "seconds": seconds,
+                                        "ms_per_call": 1000 * seconds / calls if calls else 0.0,
+                                        "share": seconds / elapsed}
+        return interval
+
+NO_PHASE = contextlib.nullcontext()
@@ -0,0 +1,257 @@
+import numpy as np
+import pygame
+from functools import lru_cache
+from board import EMPTY
+from game import JumpGame, SwapGame
+
+FLAT_TILE_SIZE = 16 # below this size tiles are drawn as flat shapes instead of scaled textures
+FLAT_COLORS = {"triangle.png": (253, 220, 83), "square.png": (83, 123, 250)}
+
+# textures are decoded once per process
+@lru_cache(maxsize=None)
+def load_texture(texture):
+    return pygame.image.load(texture).convert_alpha()
+
+# Tiles are shared between renderers and must not be drawn on. Recently used sizes stay cached,
+# so resizing the window or the grid back and forth does not scale the textures again.
+@lru_cache(maxsize=32)
+def grid_cell(texture, size):
+    square = pygame.Surface((size, size))
+    square.fill((0, 0, 0))
+    pygame.draw.rect(square, (20,20,20), (0, 0, size, size), 1)
+    if texture and size < FLAT_TILE_SIZE:
+        margin = max(1, size // 8)
+        if texture == "triangle.png":
+            pygame.draw.polygon(square, FLAT_COLORS[texture], [(margin, size-margin-1), (size/2, margin), (size-margin-1, size-margin-1)])
+        else:
+            pygame.draw.rect(square, FLAT_COLORS[texture], (margin, margin, size-2*margin, size-2*margin))
+    elif texture:
+        square.blit(pygame.transform.scale(load_texture(texture), (size, size)), (0,0))
+    return square
+
+LOD_TILE_SIZE = 8 # zoomed out below this many pixels per cell, cells are drawn as colored pixels instead of tiles
+MAX_TILE_SIZE = 200
+CELL_COLORS = np.array([(0, 0, 0), FLAT_COLORS["triangle.png"], FLAT_COLORS["square.png"]], dtype=np.uint8) # by type + 1
+
+# Draws a game onto a pygame surface. The game itself does not depend on pygame, so it can run headless.
+# The board is seen through a viewport that can be panned (drag with the right or middle mouse button), zoomed
+# (mouse wheel) and fitted to the window again (F). The visible part of the board is kept on a window sized
+# surface and only cells whose type changed since the last frame are redrawn; draw_on returns the screen
+# rectangles that changed, for pygame.display.update. When zoomed out, the type grid is turned into one pixel
+# per cell with pygame.surfarray and scaled, so very large boards stay interactive.
+class GameRenderer:
+    def __init__(self, game):
+        self.game = game
+        self.w_width, self.w_height = 100,100
+        self.size = 60 # default tile size
+        self.scale = 60.0 # pixels per cell
+        self.view_x, self.view_y = 0.0, 0.0 # board coordinates of the top left corner of the window
+        self.grid_size = None
+        self.agent_mapping = {}
+        self.view_surface = None
+        self.cell_surface = None # one pixel per cell, when zoomed out
+        self.drawn_types = None
+        self.overlay_rects = [] # highlights and labels drawn over the board in the last frame
+        self.covered_rects = [] # screen areas other windows were drawn over in the last frame
+        self.repaint = True
+        self.dragging = False
+
+    def grid_cell(self, texture = None):
+        return grid_cell(texture, self.size)
+
+    def textured(self):
+        return self.scale >= LOD_TILE_SIZE
+
+    def adapt_to_windowsize(self, w, h):
+        self.w_width = w
+        self.w_height = h
+        self.grid_size = (self.game.width, self.game.height)
+        self.set_view(min(0.9*w/self.game.width, 0.9*h/self.game.height), 0.0, 0.0)
+
+    def set_view(self, scale, view_x, view_y):
+        if scale >= LOD_TILE_SIZE:
+            # whole pixel tiles at whole pixel offsets, so panning can scroll the view
+            scale = float(int(scale))
+            view_x, view_y = round(view_x*scale)/scale, round(view_y*scale)/scale
+        self.repaint = True
+        if ((scale, view_x, view_y) == (self.scale, self.view_x, self.view_y) and self.view_surface is not None and
+                self.view_surface.get_size() == (self.w_width, self.w_height)):
+            return
+        self.scale, self.view_x, self.view_y = scale, view_x, view_y
+        self.size = max(1, int(scale))
+        if self.textured():
+            self.agent_mapping = {EMPTY: self.grid_cell(), 0:self.grid_cell("triangle.png"), 1:self.grid_cell("square.png")}
+        self.view_surface = None
+
+    # zooms by factor, keeping the board position under center in place
+    def zoom(self, factor, center):
+        x, y = self.screen_to_grid(center)
+        min_scale = min(1.0, 0.45*min(self.w_width/self.game.width, self.w_height/self.game.height))
+        scale = min(MAX_TILE_SIZE, max(min_scale, self.scale*factor))
+        self.set_view(scale, x - center[0]/scale, y - center[1]/scale)
+
+    def pan(self, dx, dy):
+        if self.view_surface is None or (dx, dy) == (0, 0):
+            self.set_view(self.scale, self.view_x - dx/self.scale, self.view_y - dy/self.scale)
+            return
+        self.view_x -= dx/self.scale
+        self.view_y -= dy/self.scale
+        self.repaint = True
+        if self.textured():
+            # only the strips scrolled into the window need new tiles
+            self.view_surface.scroll(dx, dy)
+            w, h = self.w_width, self.w_height
+            for strip in (pygame.Rect(0 if dx > 0 else w + dx, 0, abs(dx), h), pygame.Rect(0, 0 if dy > 0 else h + dy, w, abs(dy))):
+                if strip.width and strip.height:
+                    self.view_surface.fill((0, 0, 0), strip)
+                    self.draw_tiles(strip)
+        else:
+            self.view_surface.fill((0, 0, 0))
+            self.blit_cells()
+
+    # returns True if the event changed the view
+    def handle_event(self, event):
+        if event.type == pygame.MOUSEWHEEL:
+            self.zoom(1.25 ** event.y, pygame.mouse.get_pos())
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button in (2, 3):
+            self.dragging = True
+        elif event.type == pygame.MOUSEBUTTONUP and event.button in (2, 3):
+            self.dragging = False
+        elif event.type == pygame.MOUSEMOTION and self.dragging:
+            self.pan(*event.rel)
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+            self.adapt_to_windowsize(self.w_width, self.w_height)
+        else:
+            return False
+        return True
+
+    def blit_centered(self, screen, surface, center):
+        pos = (center[0] - surface.get_size()[0]/2, center[1] - surface.get_size()[1]/2)
+        self.overlay_rects.append(screen.blit(surface, pos))
+
+    def grid_pos_to_coords(self, pos):
+        return (round((pos[0] - self.view_x)*self.scale), round((pos[1] - self.view_y)*self.scale))
+
+    def grid_pos_to_center(self, pos):
+        x, y = self.grid_pos_to_coords(pos)
+        return (x + self.size/2, y + self.size/2)
+
+    def screen_to_grid(self, coords):
+        return (self.view_x + coords[0]/self.scale, self.view_y + coords[1]/self.scale)
+
+    def highlight_cell(self, screen, pos, color, width):
+        pos = self.grid_pos_to_coords(pos)
+        self.overlay_rects.append(pygame.draw.rect(screen, color, (pos[0], pos[1], self.size, self.size), width))
+
+    def cell_rect(self, pos):
+        return pygame.Rect(self.grid_pos_to_coords(pos), (self.size, self.size))
+
+    # range of board cells inside a screen rectangle, by default the window
+    def visible_cells(self, rect = None):
+        rect = rect or pygame.Rect(0, 0, self.w_width, self.w_height)
+        left, top = self.screen_to_grid(rect.topleft)
+        right, bottom = self.screen_to_grid(rect.bottomright)
+        x0, y0 = max(0, int(np.floor(left))), max(0, int(np.floor(top)))
+        x1, y1 = min(self.game.width, int(np.ceil(right))), min(self.game.height, int(np.ceil(bottom)))
+        return x0, x1, y0, y1
+
+    def draw_tiles(self, rect = None):
+        x0, x1, y0, y1 = self.visible_cells(rect)
+        for x in range(x0, x1):
+            for y in range(y0, y1):
+                self.view_surface.blit(self.agent_mapping[int(self.drawn_types[x, y])], self.grid_pos_to_coords((x,y)))
+
+    def redraw_view(self):
+        self.view_surface = pygame.Surface((self.w_width, self.w_height))
+        self.view_surface.fill((0, 0, 0))
+        if self.textured():
+            self.drawn_types = self.game.types.copy()
+            self.cell_surface = None
+            self.draw_tiles()
+        else:
+            # the cell surface is kept while zooming and panning, changes are applied by draw_on
+            if self.cell_surface is None or self.drawn_types.shape != self.game.types.shape:
+                self.drawn_types = self.game.types.copy()
+                self.cell_surface = pygame.surfarray.make_surface(CELL_COLORS[self.drawn_types + 1])
+            self.blit_cells()
+
+    # scales the visible part of the one pixel per cell surface into the view
+    def blit_cells(self):
+        x0, x1, y0, y1 = self.visible_cells()
+        if x0 >= x1 or y0 >= y1:
+            return pygame.Rect(0, 0, 0, 0)
+        left, top = self.grid_pos_to_coords((x0, y0))
+        right, bottom = self.grid_pos_to_coords((x1, y1))
+        cells = self.cell_surface.subsurface((x0, y0, x1 - x0, y1 - y0))
+        return self.view_surface.blit(pygame.transform.scale(cells, (right - left, bottom - top)), (left, top))
+
+    # copies the view back onto the screen
+    def restore(self, screen, rect):
+        screen.fill((0, 0, 0), rect)
+        screen.blit(self.view_surface, rect.topleft, area=rect)
+
+    # covered: screen rectangles of the windows drawn over the board afterwards
+    def draw_on(self, screen, font, covered = ()):
+        if self.grid_size != (self.game.width, self.game.height):
+            self.adapt_to_windowsize(self.w_width, self.w_height)
+        if self.view_surface is None or self.drawn_types.shape != self.game.types.shape:
+            self.redraw_view()
+            self.repaint = True
+        dirty = []
+        changed = np.flatnonzero(self.game.types != self.drawn_types)
+        if len(changed):
+            xs, ys = np.divmod(changed, self.game.height)
+            self.drawn_types[xs, ys] = self.game.types[xs, ys]
+            if self.textured():
+                x0, x1, y0, y1 = self.visible_cells()
+                for x, y in zip(xs.tolist(), ys.tolist()):
+                    if x0 <= x < x1 and y0 <= y < y1:
+                        dirty.append(self.view_surface.blit(self.agent_mapping[int(self.drawn_types[x, y])], self.grid_pos_to_coords((x,y))))
+            else:
+                pixels = pygame.surfarray.pixels3d(self.cell_surface)
+                pixels[xs, ys] = CELL_COLORS[self.drawn_types[xs, ys] + 1]
+                del pixels
+                dirty.append(self.blit_cells())
+        if self.repaint:
+            self.repaint = False
+            screen.blit(self.view_surface, (0, 0))
+            dirty = [screen.get_rect()]
+        else:
+            dirty.extend(self.overlay_rects)
+            dirty.extend(self.covered_rects)
+            dirty.extend(pygame.Rect(rect) for rect in covered)
+            for rect in dirty:
+                self.restore(screen, rect)
+        self.covered_rects = [pygame.Rect(rect) for rect in covered]
+        self.overlay_rects = []
+        if self.textured():
+            if isinstance(self.game, JumpGame):
+                self.draw_jump(screen, font)
+            elif isinstance(self.game, SwapGame):
+                self.draw_swap(screen, font)
+        return dirty + self.overlay_rects
+
+    def draw_jump(self, screen, font):
+        game = self.game
+        if game.jumping_agent is not None and game.jump_target is not None:
+            for pos in game.neighbors(game.jumping_agent.pos):
+                self.highlight_cell(screen, pos, (200, 150, 150, 75), 2)
+            self.highlight_cell(screen, game.jumping_agent.pos, (200, 200, 200), 4)
+            for pos in game.neighbors(game.jump_target):
+                self.highlight_cell(screen, pos, (150, 200, 150, 75), 4)
+            self.highlight_cell(screen, game.jump_target, (200, 200, 200), 2)
+            current_utility = game.jumping_agent.utility()
+            text_current_utility = font.render(str(float(int(current_utility*100)/100)), True, (0, 0, 0))
+            text_new_utility = font.render(str(float(int(game.jump_new_utility*100)/100)), True, (255, 255, 255))
+            self.blit_centered(screen, text_current_utility, self.grid_pos_to_center(game.jumping_agent.pos))
+            self.blit_centered(screen, text_new_utility, self.grid_pos_to_center(game.jump_target))
+
+    def draw_swap(self, screen, font):
+        game = self.game
+        if game.swap_agent1 is not None and game.swap_agent2 is not None:
+            for pos in game.neighbors(game.swap_agent1.pos):
+                self.highlight_cell(screen, pos, (200, 150, 150, 75), 2)
+            self.highlight_cell(screen, game.swap_agent1.pos, (200, 200, 200), 4)
+            for pos in game.neighbors(game.swap_agent2.pos):
+                self.highlight_cell(screen, pos, (150, 200, 150, 75), 4)
+            self.highlight_cell(screen, game.swap_agent2.pos, (200, 200, 200), 2)
@@ -0,0 +1,62 @@
+import threading
+import time
+
+# Advances a game (or a move log replay) on a worker thread, independently of the frame rate.
+# Animated: speed update_simulation ticks per second, so every move shows its find and execute highlights.
+# Turbo: speed moves per second via step(), without highlights; a speed of None runs as fast as possible. A step
+# of parallel jumps counts as the number of jumps it made.
+# A speed of 0 pauses. Everything that reads or changes the game from another thread has to hold self.lock.
+class SimulationThread(threading.Thread):
+    slice_seconds = 0.01 # longest time the lock is held at once
+
+    def __init__(self, simulation, speed = 1, turbo = False):
+        super().__init__(daemon=True)
+        self.simulation = simulation
+        self.speed = speed
+        self.turbo = turbo
+        self.lock = threading.Lock()
+        self.running = True
+        self.ticks = 0
+
+    def set_speed(self, speed, turbo):
+        self.speed = speed
+        self.turbo = turbo
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+    def run(self):
+        start, done, rate = time.perf_counter(), 0, None
+        while self.running:
+            speed, turbo = self.speed, self.turbo
+            if speed == 0:
+                time.sleep(0.01)
+                continue
+            if (speed, turbo) != rate:
+                # speed changed, count the rate from here on
+                start, done, rate = time.perf_counter(), 0, (speed, turbo)
+            idle = False
+            with self.lock:
+                deadline = time.perf_counter() + self.slice_seconds
+                due = None if speed is None else int((time.perf_counter() - start) * speed) + 1
+                while due is None or done < due:
+                    if turbo:
+                        moved = self.simulation.step()
+                        idle = not moved
+                        done += int(moved)
+                    else:
+                        self.simulation.update_simulation()
+                        done += 1
+                    self.ticks += 1
+                    if idle or time.perf_counter() >= deadline:
+                        break
+            if idle:
+                # nothing to do until a setting changes
+                start, done = time.perf_counter(), 0
+                time.sleep(0.02)
+            elif due is not None and done >= due:
+                time.sleep(min(0.05, max(0.0, start + (done + 1) / speed - time.perf_counter())))
+            else:
+                # give the render loop a chance to take the lock
+                time.sleep(0.001)
@@ -0,0 +1,133 @@
+import json
+import struct
+import zipfile
+import numpy as np
+from board import EMPTY
+from indexes import RandomSet, CompositionIndex
+from game import JumpGame, SwapGame
+from array_game import ArrayJumpGame, ArraySwapGame
+from utilities import utility_to_dict, utility_from_dict
+
+# A snapshot is an uncompressed .npz file holding the type grid, the neighbor counts and a JSON description of
+# everything else (mode, topology, utility, RNG state, NE). Because the arrays are stored uncompressed they can be
+# memory-mapped straight out of the archive, so even very large boards open without reading the whole file.
+# The search indexes of find_jump / find_swap are stored too, if they are built: the order of their members decides
+# the random choices of the following moves, so a loaded game continues exactly like the one that was saved.
+# A plain .npy file with a type grid can be loaded as well and gets the default settings.
+
+def save_snapshot(game, path):
+    state = {
+        "mode": "jump" if isinstance(game, JumpGame) else "swap",
+        "diagonal_neighbors": game.diagonal_neighbors,
+        "self_inclusive": game.self_inclusive,
+        "utility": utility_to_dict(game.utility_function),
+        "rng_state": game.rng.getstate(),
+        "NE": game.NE,
+        "agent_ratio": game.agent_ratio,
+        "blue_agent_ratio": game.blue_agent_ratio,
+        "best_response": getattr(game, "best_response", False),
+    }
+    np.savez(path, types=game.types, counts=game.counts, state=np.array(json.dumps(state)), **index_arrays(game))
+
+# the search indexes as arrays of flat cell indices and keys, members in their current order
+def index_arrays(game):
+    cells = lambda positions: np.array([x*game.height + y for x, y in positions], dtype=np.int64)
+    if isinstance(game, JumpGame):
+        if game.unhappy is None:
+            return {}
+        arrays = {"unhappy": cells(game.unhappy),
+                  "complete_classes": np.array(sorted(game.complete_classes), dtype=np.int64).reshape(-1, 3)}
+        arrays.update(composition_arrays("agent_classes", game.agent_classes, 3, cells))
+        arrays.update(composition_arrays("empty_buckets", game.empty_buckets, 2, cells))
+    else:
+        if game.agent_classes is None:
+            return {}
+        arrays = {"adjacent_swaps": np.stack([cells(blue for blue, _ in game.adjacent_swaps),
+                                              cells(red for _, red in game.adjacent_swaps)], axis=1)}
+        arrays.update(composition_arrays("agent_classes", game.agent_classes, 3, cells))
+    return {"index_" + name: array for name, array in arrays.items()}
+
+def composition_arrays(name, index, key_length, cells):
+    keys = list(index.members)
+    return {name + "_keys": np.array(keys, dtype=np.int64).reshape(len(keys), key_length),
+            name + "_sizes": np.array([len(index.members[key]) for key in keys], dtype=np.int64),
+            name + "_cells": cells(pos for key in keys for pos in index.members[key])}
+
+def restore_indexes(game, arrays):
+    positions = lambda cells: [divmod(cell, game.height) for cell in cells.tolist()]
+    game.agent_classes = composition_index(arrays, "agent_classes", positions)
+    if isinstance(game, JumpGame):
+        game.empty_buckets = composition_index(arrays, "empty_buckets", positions)
+        game.unhappy = RandomSet(positions(arrays["unhappy"]))
+        game.complete_classes = set(tuple(key) for key in arrays["complete_classes"].tolist())
+    else:
+        game.adjacent_swaps = RandomSet(zip(positions(arrays["adjacent_swaps"][:, 0]),
+                                            positions(arrays["adjacent_swaps"][:, 1])))
+
+def composition_index(arrays, name, positions):
+    index = CompositionIndex()
+    members = positions(arrays[name + "_cells"])
+    start = 0
+    for key, size in zip(arrays[name + "_keys"].tolist(), arrays[name + "_sizes"].tolist()):
+        for pos in members[start:start+size]:
+            index.set(pos, tuple(key))
+        start += size
+    return index
+
+# Maps an array stored uncompressed in a .npz archive. Writes only go to private copies of the touched pages.
+def memmap_member(path, name):
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode="c", shape=shape, offset=offset, order="F" if fortran_order else "C")
+
+def load_snapshot(path, engine = "array", mmap = True):
+    if path.endswith(".npy"):
+        types = np.load(path, mmap_mode="c" if mmap else None).astype(np.int8, copy=False)
+        counts = None
+        state = {"mode": "jump" if (types == EMPTY).any() else "swap"}
+        indexes = {}
+    else:
+        with np.load(path) as data:
+            state = json.loads(str(data["state"]))
+            indexes = {name[len("index_"):]: data[name] for name in data.files if name.startswith("index_")}
+            if not mmap:
+                types, counts = data["types"], data["counts"]
+        if mmap:
+            types, counts = memmap_member(path, "types"), memmap_member(path, "counts")
+            if types is None or counts is None:
+                return load_snapshot(path, engine, mmap = False)
+
+    if state["mode"] == "jump":
+        game_class = ArrayJumpGame if engine == "array" else JumpGame
+    else:
+        game_class = ArraySwapGame if engine == "array" else SwapGame
+    utility = utility_from_dict(state["utility"]) if "utility" in state else None
+    # a 1x1 board keeps the constructor from generating a full random board that is replaced right away
+    game = game_class(1, 1, utility) if utility else game_class(1, 1)
+    game.diagonal_neighbors = state.get("diagonal_neighbors", True)
+    game.self_inclusive = state.get("self_inclusive", True)
+    game.agent_ratio = state.get("agent_ratio", game.agent_ratio)
+    game.blue_agent_ratio = state.get("blue_agent_ratio", game.blue_agent_ratio)
+    if "best_response" in state and isinstance(game, JumpGame):
+        game.best_response = state["best_response"]
+    game.load_types(types, counts)
+    if "rng_state" in state:
+        version, internal_state, gauss_next = state["rng_state"]
+        game.rng.setstate((version, tuple(internal_state), gauss_next))
+    game.NE = state.get("NE", False)
+    if indexes and not game.NE:
+        restore_indexes(game, indexes)
+    return game
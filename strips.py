@@ -0,0 +1,145 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from board import select_jumps, jump_link_deltas, move_agents
+
+# Makes the parallel jumps of an ArrayJumpGame on several cores, e.g.
+#   python headless.py --engine array --width 4000 --height 2500 --workers 8
+# The game's type grid and neighbor counts are moved into shared memory and the torus is cut into strips of whole
+# rows, one per worker process. Every round has two phases:
+# - Each worker selects non-interfering improving jumps (see board.select_jumps) whose origins and targets lie in
+#   the interior of its strip, i.e. not in its first or last row, and makes them in place. The neighborhoods of
+#   these cells stay inside the strip, so no worker reads a cell another worker writes, and jumps of different
+#   strips do not interfere either.
+# - The main process then does the same for the two rows on either side of every strip boundary, which no worker
+#   touched, one boundary after another.
+# Every jump is improving when it is made, so the run is a valid sequence of the jumps of JumpGame.find_jump. Jumps
+# stay within a strip or boundary band; once none are left the game falls back to its own parallel and sequential
+# search, which also detects the Nash equilibrium.
+
+worker_board = {}
+
+def attach_worker(types_name, counts_name, shape):
+    types_memory = shared_memory.SharedMemory(name=types_name)
+    counts_memory = shared_memory.SharedMemory(name=counts_name)
+    worker_board["memory"] = (types_memory, counts_memory)
+    worker_board["types"] = np.ndarray(shape, dtype=np.int8, buffer=types_memory.buf)
+    worker_board["counts"] = np.ndarray((2,) + shape, dtype=np.int8, buffer=counts_memory.buf)
+
+# Selects and makes jumps within rows 1 to len(types) - 2 of a part of the board.
+# Returns the jumps as an (n, 2) array of flat indices into the part, the change of same_type_links by each of them
+# and the number of agents and cells looked at.
+def band_jumps(types, counts, tables, offsets, self_mult, seed, rounds):
+    rng = np.random.default_rng(seed)
+    jumps, evaluations = select_jumps(types, counts, tables, offsets, self_mult, rng, rounds, rows=(1, len(types) - 1))
+    jumps = np.array(jumps, dtype=np.int64).reshape(-1, 2)
+    # all counts the jumps see and change belong to cells of the part
+    deltas = jump_link_deltas(types, counts, self_mult, jumps[:, 0], jumps[:, 1])
+    if len(jumps):
+        move_agents(types, counts, offsets, jumps[:, 0], jumps[:, 1])
+    return jumps, deltas, evaluations
+
+def strip_jumps(task):
+    start, stop, tables, offsets, self_mult, seed, rounds = task
+    return band_jumps(worker_board["types"][start:stop], worker_board["counts"][:, start:stop],
+                      tables, offsets, self_mult, seed, rounds)
+
+class StripPool:
+    def __init__(self, game, workers = None, rounds = 4):
+        self.game = game
+        self.workers = workers or os.cpu_count()
+        self.rounds = rounds
+        self.pool = None
+        self.memory = []
+        self.types = None
+        self.counts = None
+        game.strip_pool = self
+        self.share()
+
+    # moves the board of the game into shared memory and starts the workers on it
+    def share(self):
+        self.release()
+        game = self.game
+        width, height = game.types.shape
+        # strips of at least 4 rows, so that they have an interior and the boundary bands do not overlap
+        strips = min(self.workers, width // 4)
+        if strips < 2 or height < 2:
+            return
+        self.types, self.counts = self.shared_copy(game.types), self.shared_copy(game.counts)
+        game.types, game.counts = self.types, self.counts
+        self.bounds = [width * i // strips for i in range(strips + 1)]
+        self.pool = multiprocessing.Pool(strips, initializer=attach_worker,
+                                         initargs=(self.memory[0].name, self.memory[1].name, game.types.shape))
+
+    def shared_copy(self, array):
+        memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.memory.append(memory)
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)
+        shared[...] = array
+        return shared
+
+    # stops the workers and hands the game a private copy of its board
+    def release(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.types is not None and self.game.types is self.types:
+            self.game.types = np.array(self.types)
+        if self.counts is not None and self.game.counts is self.counts:
+            self.game.counts = np.array(self.counts)
+        self.types = self.counts = None
+        for memory in self.memory:
+            memory.close()
+            memory.unlink()
+        self.memory = []
+
+    def close(self):
+        self.release()
+        if self.game.strip_pool is self:
+            self.game.strip_pool = None
+
+    # one round of both phases, returns the number of jumps made
+    def make_jumps(self):
+        game = self.game
+        if game.types is not self.types or game.counts is not self.counts:
+            # the game generated or loaded a new board
+            self.share()
+        if self.pool is None:
+            return 0
+        width, height = game.types.shape
+        tables = game.utility_tables()
+        tasks = [(start, stop, tables, game.offsets, game.self_mult, game.rng.getrandbits(64), self.rounds)
+                 for start, stop in zip(self.bounds, self.bounds[1:])]
+        moves, deltas = [], []
+        for start, (jumps, jump_deltas, evaluations) in zip(self.bounds, self.pool.map(strip_jumps, tasks)):
+            moves.append(jumps + start * height)
+            deltas.append(jump_deltas)
+            game.evaluations += evaluations
+        # every phase is logged once it is made, so keyframes see the board that matches the move count
+        if game.move_log is not None:
+            game.move_log.record_batch(np.concatenate(moves).tolist())
+        for start in self.bounds[:-1]:
+            rows = np.arange(start - 2, start + 2) % width
+            types, counts = game.types[rows], game.counts[:, rows]
+            jumps, jump_deltas, evaluations = band_jumps(types, counts, tables, game.offsets, game.self_mult,
+                                                         game.rng.getrandbits(64), self.rounds)
+            if len(jumps):
+                game.types[rows], game.counts[:, rows] = types, counts
+                moves.append(rows[jumps // height] * height + jumps % height)
+                deltas.append(jump_deltas)
+                if game.move_log is not None:
+                    game.move_log.record_batch(moves[-1].tolist())
+            game.evaluations += evaluations
+        moves = np.concatenate(moves)
+        if len(moves) == 0:
+            return 0
+        game.jumps_made(moves[:, 0].tolist(), moves[:, 1].tolist())
+        links = game.same_type_links + np.cumsum(np.concatenate(deltas))
+        game.same_type_links = int(links[-1])
+        if game.metrics is not None:
+            # LS(G) after each of the jumps, in the order they are logged
+            for value in links.tolist():
+                game.metrics.record(value / (len(game.offsets) * (game.r + game.b)))
+        return len(moves)
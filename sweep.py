@@ -0,0 +1,162 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import os
+import statistics
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fractions import Fraction
+from headless import UTILITIES, make_utility, make_game, run
+from ensemble import Ensemble
+
+# Runs the same experiment over a grid of utility parameters, densities, blue ratios and seeds on all cores,
+# e.g. python sweep.py --utility tau --tau 0.3 0.5 0.7 --density 0.7 0.9 --seeds 10 --output sweep.csv
+# Every finished run is appended to the output file right away; running the same command again
+# skips the configurations that are already in it.
+# With --engine ensemble, all seeds of a configuration run together as one batch (see ensemble.py), which is
+# much faster for many runs of small boards.
+
+UTILITY_PARAMETERS = {
+    "single-peaked": ["peak"],
+    "tau": ["tau"],
+    "tau-no-seg": ["tau"],
+    "trapezoid": ["l", "r"],
+    "rectangle": ["l", "r"],
+    "custom": ["custom"],
+}
+
+CONFIG_FIELDS = ["mode", "engine", "width", "height", "torus", "self_inclusive", "utility",
+                 "peak", "tau", "l", "r", "custom", "density", "blue", "seed"]
+RESULT_FIELDS = ["moves", "NE", "ls", "initial_ls", "setup_seconds", "seconds", "moves_per_second"]
+
+def configurations(args):
+    parameters = UTILITY_PARAMETERS[args.utility]
+    values = {"peak": args.peak, "tau": args.tau, "l": args.l, "r": args.r, "custom": [args.custom]}
+    for utility_values in itertools.product(*(values[p] for p in parameters)):
+        utility_parameters = dict(zip(parameters, utility_values))
+        if "l" in utility_parameters and utility_parameters["l"] > utility_parameters["r"]:
+            continue
+        for density, blue, seed in itertools.product(args.density, args.blue, args.seeds):
+            config = {field: "" for field in CONFIG_FIELDS}
+            config.update(utility_parameters)
+            config.update({"mode": args.mode, "engine": args.engine, "width": args.width, "height": args.height,
+                           "torus": args.torus, "self_inclusive": not args.self_exclusive, "utility": args.utility,
+                           "density": density, "blue": blue, "seed": seed})
+            yield config
+
+def config_key(config):
+    return tuple(str(config[field]) for field in CONFIG_FIELDS)
+
+def completed_configurations(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline="") as f:
+        return set(config_key(row) for row in csv.DictReader(f))
+
+def run_configuration(config, max_moves = None, time_limit = None):
+    utility = make_utility(config["utility"], **{p: config[p] for p in UTILITY_PARAMETERS[config["utility"]]})
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        game = make_game(config["mode"], config["engine"], config["width"], config["height"], utility,
+                         config["density"], config["blue"], config["torus"], config["self_inclusive"], config["seed"])
+        setup_seconds = time.perf_counter() - start
+        initial_ls = game.ls
+        result = run(game, max_moves, time_limit)
+    row = dict(config)
+    row.update(result)
+    row["initial_ls"] = initial_ls
+    row["setup_seconds"] = setup_seconds
+    return row
+
+# runs configurations that only differ in their seed as one ensemble; --time-limit applies to the whole batch
+def run_ensemble(configs, max_moves = None, time_limit = None):
+    config = configs[0]
+    utility = make_utility(config["utility"], **{p: config[p] for p in UTILITY_PARAMETERS[config["utility"]]})
+    start = time.perf_counter()
+    ensemble = Ensemble.random(config["mode"], config["width"], config["height"], utility, [c["seed"] for c in configs],
+                               config["density"], config["blue"], config["torus"], config["self_inclusive"])
+    setup_seconds = time.perf_counter() - start
+    initial_ls = ensemble.ls
+    seconds = ensemble.run(max_moves, time_limit)
+    rows = []
+    for i, config in enumerate(configs):
+        row = dict(config)
+        row.update({"moves": int(ensemble.moves[i]), "NE": bool(ensemble.NE[i]), "ls": float(ensemble.ls[i]),
+                    "initial_ls": float(initial_ls[i]), "setup_seconds": setup_seconds, "seconds": seconds,
+                    "moves_per_second": ensemble.moves[i] / seconds if seconds > 0 else 0.0})
+        rows.append(row)
+    return rows
+
+# mean of the results over all seeds of a configuration
+def summarize(path):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(row[field] for field in CONFIG_FIELDS if field != "seed")].append(row)
+    columns = [field for field in CONFIG_FIELDS if field != "seed" and len(set(row[field] for row in rows)) > 1]
+    print("\t".join(columns + ["runs", "NE", "moves", "ls", "seconds"]))
+    for group in groups.values():
+        mean = lambda field: statistics.mean(float(row[field]) for row in group)
+        converged = sum(row["NE"] == "True" for row in group)
+        print("\t".join([group[0][c] for c in columns] +
+                        [str(len(group)), str(converged), "%.1f" % mean("moves"), "%.4f" % mean("ls"), "%.3f" % mean("seconds")]))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of headless Schelling games in parallel")
+    parser.add_argument("--mode", choices=["jump", "swap"], default="jump")
+    parser.add_argument("--engine", choices=["object", "array", "ensemble"], default="object")
+    parser.add_argument("--width", type=int, default=25)
+    parser.add_argument("--height", type=int, default=25)
+    parser.add_argument("--torus", choices=["8-Torus", "4-Torus"], default="8-Torus")
+    parser.add_argument("--self-exclusive", action="store_true")
+    parser.add_argument("--utility", choices=UTILITIES, default="single-peaked")
+    parser.add_argument("--peak", type=Fraction, nargs="+", default=[Fraction(1,2)])
+    parser.add_argument("--tau", type=Fraction, nargs="+", default=[Fraction(1,2)])
+    parser.add_argument("--l", type=float, nargs="+", default=[0.25])
+    parser.add_argument("--r", type=float, nargs="+", default=[0.75])
+    parser.add_argument("--custom", default="min(frac, 0.5)")
+    parser.add_argument("--density", type=float, nargs="+", default=[0.8])
+    parser.add_argument("--blue", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--seeds", type=int, default=10, help="number of seeds per configuration (0 .. seeds-1)")
+    parser.add_argument("--max-moves", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds per run")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument("--output", default="sweep.csv")
+    args = parser.parse_args()
+    args.seeds = range(args.seeds)
+    return args
+
+def main():
+    args = parse_args()
+    done = completed_configurations(args.output)
+    configs = list(configurations(args))
+    pending = [config for config in configs if config_key(config) not in done]
+    print("%d runs, %d already done" % (len(configs), len(configs) - len(pending)))
+    new_file = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+    with open(args.output, "a", newline="") as f, ProcessPoolExecutor(args.workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=CONFIG_FIELDS + RESULT_FIELDS)
+        if new_file:
+            writer.writeheader()
+        if args.engine == "ensemble":
+            batches = defaultdict(list)
+            for config in pending:
+                batches[tuple(str(config[field]) for field in CONFIG_FIELDS if field != "seed")].append(config)
+            futures = [executor.submit(run_ensemble, configs, args.max_moves, args.time_limit) for configs in batches.values()]
+        else:
+            futures = [executor.submit(run_configuration, config, args.max_moves, args.time_limit) for config in pending]
+        done_runs = 0
+        for future in as_completed(futures):
+            rows = future.result() if args.engine == "ensemble" else [future.result()]
+            writer.writerows(rows)
+            f.flush()
+            done_runs += len(rows)
+            print("%d/%d" % (done_runs, len(pending)), end="\r")
+    print()
+    summarize(args.output)
+
+if __name__ == '__main__':
+    main()
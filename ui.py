@@ -1,4 +1,5 @@
 ﻿from collections import defaultdict
+import time
 import pygame
 import pygame_gui
 from fractions import Fraction
@@ -12,6 +13,7 @@ from pygame_gui.elements import UILabel
 import numpy as np 
 
 from utilities import *
+from metrics import MetricsHistory
 
 class UICallbackManager:
     def __init__(self):
@@ -36,29 +38,91 @@ class MetricsWindow(UIWindow):
                             object_id=id,
                             resizable=True)
         self.game = game
-        self.points = [None] * 1001
-        self.points[0] = 0
-        self.current_point = 1
+        self.history = MetricsHistory()
+        self.history.attach(game)
+        self.span = None # number of most recent moves shown, None for the whole run
+        self.plot = None # cached plot, redrawn only after new samples, a zoom or a resize
+        self.plot_key = None
 
-    def update(self, time_delta):
-        self.points[self.current_point] = self.game.ls
-        self.current_point = (self.current_point + 1) % len(self.points)
-        self.render(time_delta)
+    # the mouse wheel zooms in on the most recent moves and back out to the whole run
+    def process_event(self, event):
+        if event.type == pygame.MOUSEWHEEL and self.rect.collidepoint(pygame.mouse.get_pos()):
+            span = self.history.count if self.span is None else self.span
+            span = span // 2 if event.y > 0 else span * 2
+            self.span = None if span >= self.history.count else max(span, 16)
+            return True
+        return super().process_event(event)
 
-    def render(self, time_delta):
+    def update(self, time_delta):
         self.image.fill((50,50,50))
         super().update(time_delta)
+        key = (self.history.count, self.span, self.image.get_size())
+        if key != self.plot_key:
+            self.plot_key = key
+            self.render()
+        self.image.blit(self.plot, (0, 0))
 
-        step_size = 0.001
-        scaled_points = []
-        for i, f_i in enumerate(np.arange(0.0, 1.0+step_size, step_size)):
-            val = self.points[i]
-            if val is not None:
-                h = self.rect.height - 75
-                scaled_pt = (i*step_size*self.rect.width*0.8 + self.rect.width*0.1, h-(val*h*0.8) - h*0.1+35)
-                scaled_points.append(scaled_pt)
+    # draws the minimum and maximum of every column, which is the exact curve once there are fewer moves than columns
+    def render(self):
+        self.plot = pygame.Surface(self.image.get_size(), pygame.SRCALPHA)
+        columns = max(2, int(self.rect.width*0.8))
+        mins, maxs = self.history.envelope(self.span, columns)
+        if len(mins) == 0:
+            return
+        h = self.rect.height - 75
+        xs = self.rect.width*0.1 + np.arange(len(mins)) * (self.rect.width*0.8 / max(1, len(mins) - 1))
+        top = list(zip(xs, h - maxs*h*0.8 - h*0.1 + 35))
+        bottom = list(zip(xs, h - mins*h*0.8 - h*0.1 + 35))
+        if len(top) == 1:
+            top.append(top[0])
+            bottom.append(bottom[0])
+        if (maxs > mins).any():
+            pygame.draw.polygon(self.plot, (200,200,200), top + bottom[::-1])
+        pygame.draw.lines(self.plot, (200,200,200), False, top, width=2)
+        pygame.draw.lines(self.plot, (200,200,200), False, bottom, width=2)
+
+    def on_close_window_button_pressed(self):
+        self.hide()
+
+# Rates, frame time percentiles and the most expensive phases of a profiler.Profiler, refreshed twice a second
+class ProfilerWindow(UIWindow):
+    refresh_seconds = 0.5
 
-        pygame.draw.lines(self.image, (200,200,200), False, scaled_points, width=2)
+    def __init__(self, rect, ui_manager, profiler, title = "Profiler (F3)", id = '#profiler'):
+        super().__init__(rect, ui_manager,
+                            window_display_title=title,
+                            object_id=id,
+                            resizable=True)
+        self.profiler = profiler
+        self.font = pygame.font.Font(pygame.font.get_default_font(), 12)
+        self.text = None
+        self.age = self.refresh_seconds
+
+    def update(self, time_delta):
+        self.image.fill((50,50,50))
+        super().update(time_delta)
+        self.age += time_delta
+        if self.text is None or self.age >= self.refresh_seconds or self.text.get_size() != self.image.get_size():
+            self.age = 0
+            self.render()
+        self.image.blit(self.text, (0, 0))
+
+    def render(self):
+        self.text = pygame.Surface(self.image.get_size(), pygame.SRCALPHA)
+        report = self.profiler.interval()
+        lines = ["moves/s: %.0f   evaluations/s: %.0f" % (report["moves_per_second"], report["evaluations_per_second"])]
+        if "frame_ms" in report:
+            lines.append("frame ms p50 %.1f  p90 %.1f  p99 %.1f" % tuple(report["frame_ms"][p] for p in ("p50", "p90", "p99")))
+        for name, phase in sorted(report["phases"].items(), key=lambda item: -item[1]["share"]):
+            lines.append("%-24s %5.1f%% %8.3f ms" % (name, 100 * phase["share"], phase["ms_per_call"]))
+        # the image includes the window's shadow and title bar, the text goes into the container area
+        content = self.get_container().get_rect()
+        x, y = content.x - self.rect.x + 5, content.y - self.rect.y + 5
+        for line in lines:
+            if y + 15 > content.bottom - self.rect.y:
+                break
+            self.text.blit(self.font.render(line, True, (200,200,200)), (x, y))
+            y += 15
 
     def on_close_window_button_pressed(self):
         self.hide()
@@ -70,16 +134,24 @@ class GraphWindow(UIWindow):
                             object_id=id,
                             resizable=True)
         self.game = game
+        self.curve = None
+        self.curve_table = None
     def update(self, time_delta):
         
         self.image.fill((50,50,50))
         super().update(time_delta)
-        step_size = 0.01
-        points = []
-        for i, f_i in enumerate(np.arange(0.0, 1.0+step_size, step_size)):
-            h = self.rect.height - 75
-            points.append((i*step_size*self.rect.width*0.8 + self.rect.width*0.1, h-(self.game.utility_function(f_i)*h*0.8) - h*0.1+35))
-        pygame.draw.lines(self.image, (200,200,200), False, points, width=2)
+        # the utility table is rebuilt whenever the utility or one of its parameters changes
+        table = self.game.utility_function.table()
+        if self.curve is None or self.curve_table is not table or self.curve.get_size() != self.image.get_size():
+            self.curve = pygame.Surface(self.image.get_size(), pygame.SRCALPHA)
+            self.curve_table = table
+            step_size = 0.01
+            points = []
+            for i, f_i in enumerate(np.arange(0.0, 1.0+step_size, step_size)):
+                h = self.rect.height - 75
+                points.append((i*step_size*self.rect.width*0.8 + self.rect.width*0.1, h-(self.game.utility_function(f_i)*h*0.8) - h*0.1+35))
+            pygame.draw.lines(self.curve, (200,200,200), False, points, width=2)
+        self.image.blit(self.curve, (0, 0))
     def on_close_window_button_pressed(self):
         self.hide()
 
@@ -100,12 +172,15 @@ class UISliderProperty:
                 if self.value_range is not None:
                     val = clip(val, self.value_range[0], self.value_range[1])
                 self.slider.set_current_value(val)
+                window.property_changed(self.name)
             except:
                 pass
+        def slider_moved(event):
+            self.value_text.set_text(str(self.slider.get_current_value()))
+            window.property_changed(self.name)
             
         window.callback_manager.add_callback(pygame_gui.UI_TEXT_ENTRY_CHANGED, self.value_text, value_text_changed)
-        window.callback_manager.add_callback(pygame_gui.UI_HORIZONTAL_SLIDER_MOVED, self.slider, 
-                                           lambda event: self.value_text.set_text(str(self.slider.get_current_value())))
+        window.callback_manager.add_callback(pygame_gui.UI_HORIZONTAL_SLIDER_MOVED, self.slider, slider_moved)
     def get_value(self):
         return self.slider.get_current_value()
     def update(self):
@@ -121,6 +196,7 @@ class UIDropDownProperty:
         self.label = window.make(UILabel, text = name)
         def set_value(event):
             self.value = event.text
+            window.property_changed(self.name)
         self.dropdown = window.make(UIDropDownMenu, options_list = options_list, starting_option = starting_option, **kwargs)
         window.callback_manager.add_callback(pygame_gui.UI_DROP_DOWN_MENU_CHANGED, self.dropdown, set_value)
     def update(self):
@@ -141,6 +217,7 @@ class UITextProperty:
         self.value = text
         def value_text_changed(event):
             self.value = event.text
+            window.property_changed(self.name)
             
         window.callback_manager.add_callback(pygame_gui.UI_TEXT_ENTRY_CHANGED, self.value_text, value_text_changed)
     def update(self):
@@ -199,9 +276,20 @@ class SettingsWindow(UIWindow):
         return obj
     
     def rebuild_ui(self):
+        self.layout_size = self.rect.size
         self.current_row = 0.25
         for name, prop in self.properties.items():
             self.make_row(*prop.ui_elements())
+
+    # Widgets report their changes here and update() only applies the changed properties to the game.
+    # Properties that regenerate the board wait until they have not changed for debounce_seconds,
+    # so dragging a slider does not generate a new board for every value it passes.
+    debounce_seconds = 0.3
+    regenerating = {"Width", "Height", "All Agents", "Blue Agents"}
+
+    def property_changed(self, name):
+        self.dirty.add(name)
+        self.changed_at[name] = time.perf_counter()
             
     def __init__(self, rect, ui_manager, game):
         super().__init__(rect, ui_manager,
@@ -218,14 +306,21 @@ class SettingsWindow(UIWindow):
         self.rebuild()
         self.default_rect = pygame.Rect((0,0), (125, self.row_y))
         self.callback_manager = UICallbackManager()
+        self.dirty = set()
+        self.changed_at = {}
         
         
         
         self.add_ui_property(UISliderProperty(self, "Simulation Speed", start_value = 1, value_range=(0, 100), click_increment = 1))
+        self.add_ui_property(UIDropDownProperty(self, "Simulation Mode", starting_option = "Animated", options_list = ["Animated", "Turbo"]))
+        self.add_ui_property(UISliderProperty(self, "Turbo Moves/s", start_value = 0, value_range=(0, 100000), click_increment = 100))
         self.add_ui_property(UISliderProperty(self, "Width", start_value  = 20, value_range=(1, 100), click_increment = 1))
         self.add_ui_property(UISliderProperty(self, "Height", start_value = 20, value_range=(1, 100), click_increment = 1))
         self.add_ui_property(UIDropDownProperty(self, "Torus Type", starting_option = "8-Torus", options_list = ["8-Torus", "4-Torus"]))
         self.add_ui_property(UIDropDownProperty(self, "Neighborhood", starting_option = "Self-Inclusive", options_list = ["Self-Inclusive", "Self-Exclusive"]))
+        if isinstance(game, JumpGame):
+            self.add_ui_property(UIDropDownProperty(self, "Jump Target", starting_option = "Any Improving", options_list = ["Any Improving", "Best Response"]))
+            self.add_ui_property(UIDropDownProperty(self, "Parallel Jumps", starting_option = "Off", options_list = ["Off", "On"]))
         # self.add_ui_property(UIDropDownProperty(self, "Jump or Swap", starting_option = "Jump", options_list = ["Jump", "Swap"]))
 
         self.add_ui_property(UISliderProperty(self, "All Agents", start_value = 0.8, value_range=(0.0, 1.0), click_increment = 0.005))
@@ -250,10 +345,13 @@ class SettingsWindow(UIWindow):
         
         self.game_type = "Single-Peaked"
         self.rebuild_ui()
+        # the first update brings the game in line with the initial widget values
+        self.dirty = set(self.properties)
     
     def update(self, time_delta):
         super().update(time_delta)
-        self.rebuild_ui()
+        if self.rect.size != self.layout_size:
+            self.rebuild_ui()
         for name, prop in self.properties.items():
             prop.update()
 
@@ -262,12 +360,28 @@ class SettingsWindow(UIWindow):
         #     self.game = JumpGame(self.game.width, self.game.height, self.game.utility_function)
         # elif jump_or_swap == "Swap" and isinstance(self.game, JumpGame):
         #     self.game = SwapGame(self.game.width, self.game.height, self.game.utility_function)
+
+        now = time.perf_counter()
+        changed = {name for name in self.dirty
+                   if name not in self.regenerating or now - self.changed_at.get(name, 0) >= self.debounce_seconds}
+        if not changed:
+            return
+        self.dirty -= changed
         
-        self.game.set_agents(self.properties["All Agents"].get_value())
-        self.game.set_grid_size(self.properties["Width"].get_value(), self.properties["Height"].get_value())
-        self.game.set_torus_type(self.properties["Torus Type"].get_value())
-        self.game.set_self_inclusive(self.properties["Neighborhood"].get_value() == "Self-Inclusive")
-        self.game.set_blue_agents(self.properties["Blue Agents"].get_value())
+        if "All Agents" in changed:
+            self.game.set_agents(self.properties["All Agents"].get_value())
+        if "Width" in changed or "Height" in changed:
+            self.game.set_grid_size(self.properties["Width"].get_value(), self.properties["Height"].get_value())
+        if "Torus Type" in changed:
+            self.game.set_torus_type(self.properties["Torus Type"].get_value())
+        if "Neighborhood" in changed:
+            self.game.set_self_inclusive(self.properties["Neighborhood"].get_value() == "Self-Inclusive")
+        if "Blue Agents" in changed:
+            self.game.set_blue_agents(self.properties["Blue Agents"].get_value())
+        if "Jump Target" in changed:
+            self.game.best_response = self.properties["Jump Target"].get_value() == "Best Response"
+        if "Parallel Jumps" in changed:
+            self.game.parallel = self.properties["Parallel Jumps"].get_value() == "On"
         
         if self.game_type != self.properties["Game Type"].get_value():
             self.game_type = self.properties["Game Type"].get_value()
@@ -284,24 +398,25 @@ class SettingsWindow(UIWindow):
             if self.game_type == "Rectangle":
                 self.game.set_utility_function(RectangularUtility(self.properties["l"].get_value(), self.properties["r"].get_value()))
         
-        if self.game_type == ">=Tau":
-            if self.game.utility_function.tau != Fraction(self.properties["Tau"].get_value()):
-                self.game.NE = False    
-            self.game.utility_function.tau = Fraction(self.properties["Tau"].get_value())
-        if self.game_type == ">=Tau and <1":
-            if self.game.utility_function.tau != Fraction(self.properties["Tau"].get_value()):
-                self.game.NE = False    
-            self.game.utility_function.tau = Fraction(self.properties["Tau"].get_value())
-        if self.game_type == "Single-Peaked":
-            if self.game.utility_function.peak != Fraction(self.properties["Peak"].get_value()):
-                self.game.NE = False    
-            self.game.utility_function.peak = Fraction(self.properties["Peak"].get_value())
-        if self.game_type == "Custom":
-            if self.game.utility_function.code != self.properties["Custom U_i(frac) = "].get_value():
-                self.game.NE = False    
-            self.game.utility_function.code = self.properties["Custom U_i(frac) = "].get_value()
-        if self.game_type == "Trapezoid" or self.game_type == "Rectangle":
-            if self.game.utility_function.l != self.properties["l"].get_value() or self.game.utility_function.r != self.properties["r"].get_value():
-                self.game.NE = False    
-            self.game.utility_function.l = self.properties["l"].get_value()
-            self.game.utility_function.r = self.properties["r"].get_value()
\ No newline at end of file
+        # parameters are only assigned when they differ, assigning one discards the utility's lookup table
+        if self.game_type in (">=Tau", ">=Tau and <1") and "Tau" in changed:
+            tau = Fraction(self.properties["Tau"].get_value())
+            if self.game.utility_function.tau != tau:
+                self.game.NE = False
+                self.game.utility_function.tau = tau
+        if self.game_type == "Single-Peaked" and "Peak" in changed:
+            peak = Fraction(self.properties["Peak"].get_value())
+            if self.game.utility_function.peak != peak:
+                self.game.NE = False
+                self.game.utility_function.peak = peak
+        if self.game_type == "Custom" and "Custom U_i(frac) = " in changed:
+            code = self.properties["Custom U_i(frac) = "].get_value()
+            if self.game.utility_function.code != code:
+                self.game.NE = False
+                self.game.utility_function.code = code
+        if self.game_type in ("Trapezoid", "Rectangle") and ("l" in changed or "r" in changed):
+            l, r = self.properties["l"].get_value(), self.properties["r"].get_value()
+            if self.game.utility_function.l != l or self.game.utility_function.r != r:
+                self.game.NE = False
+                self.game.utility_function.l = l
+                self.game.utility_function.r = r
@@ -1,8 +1,34 @@
 ﻿from abc import ABC, abstractmethod
+from fractions import Fraction
+from functools import lru_cache, reduce
 import ast, math
+import numpy as np
+from board import MAX_NEIGHBORS
 
 locals =  {key: value for (key,value) in vars(math).items() if key[0] != '_'}
 locals.update({"abs": abs, "complex": complex, "min": min, "max": max, "pow": pow, "round": round})
+scalar_globals = dict(locals, __builtins__ = None)
+
+# NumPy counterparts of the whitelisted names that give the same values element by element, so a formula can be
+# evaluated over an array of fractions at once. Names that are missing here (remainder, isclose, gcd, 2-argument
+# log, ...) make the array evaluation fail, which falls back to evaluating element by element.
+# Functions of one argument are wrapped, as a second argument would be taken as NumPy's `out`.
+def unary(function):
+    return lambda x: function(x)
+
+ARRAY_CONSTANTS = ["pi", "e", "tau", "inf", "nan"]
+ARRAY_UNARY = {"sqrt": np.sqrt, "cbrt": np.cbrt, "exp": np.exp, "exp2": np.exp2, "expm1": np.expm1, "log": np.log,
+               "log2": np.log2, "log10": np.log10, "log1p": np.log1p, "sin": np.sin, "cos": np.cos, "tan": np.tan,
+               "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan, "sinh": np.sinh, "cosh": np.cosh,
+               "tanh": np.tanh, "asinh": np.arcsinh, "acosh": np.arccosh, "atanh": np.arctanh, "fabs": np.fabs,
+               "floor": np.floor, "ceil": np.ceil, "trunc": np.trunc, "degrees": np.degrees, "radians": np.radians,
+               "abs": np.abs, "round": np.round}
+ARRAY_BINARY = {"atan2": np.arctan2, "hypot": np.hypot, "copysign": np.copysign, "fmod": np.fmod, "pow": np.power}
+array_locals = {key: locals[key] for key in ARRAY_CONSTANTS if key in locals}
+array_locals.update({key: unary(function) for key, function in ARRAY_UNARY.items() if key in locals})
+array_locals.update({key: function for key, function in ARRAY_BINARY.items() if key in locals})
+array_locals.update({"min": lambda *args: reduce(np.minimum, args), "max": lambda *args: reduce(np.maximum, args)})
+array_globals = dict(array_locals, __builtins__ = None)
 
 class Visitor(ast.NodeVisitor):
     def visit(self, node):
@@ -14,26 +40,80 @@ class Visitor(ast.NodeVisitor):
             ast.Mult, ast.Div, ast.Pow, ast.BitOr, ast.BitAnd, ast.BitXor, ast.USub, ast.UAdd, ast.FloorDiv, ast.Mod,
             ast.LShift, ast.RShift, ast.Invert, ast.Call, ast.Name)
 
-def evaluate(expr, extra_locals):
+@lru_cache(maxsize=128)
+def compile_expression(expr):
     if any(elem in expr for elem in '\n#') : raise ValueError(expr)
     try:
         node = ast.parse(expr.strip(), mode='eval')
         Visitor().visit(node)
-        locals.update(extra_locals)
-        return eval(compile(node, "<string>", "eval"), {'__builtins__': None}, locals)
+        return compile(node, "<string>", "eval")
     except Exception: raise ValueError(expr)
 
+# Utilities only depend on the number of same and other type neighbors, so each one is materialized
+# into a table[same, other]. The table is rebuilt lazily after a parameter actually changed.
+class Utility():
+    _table = None
+
+    def __setattr__(self, name, value):
+        if name[0] != '_' and getattr(self, name, None) != value:
+            object.__setattr__(self, '_table', None)
+        object.__setattr__(self, name, value)
+
+    def table(self):
+        if self._table is None:
+            table = np.zeros((MAX_NEIGHBORS+1, MAX_NEIGHBORS+1))
+            for same in range(MAX_NEIGHBORS+1):
+                for other in range(MAX_NEIGHBORS+1):
+                    f_i = 0.0
+                    if same + other > 0:
+                        f_i = Fraction(same, same + other)
+                    table[same, other] = self(f_i)
+            self._table = table
+        return self._table
+
+class CustomUtility(Utility):
+    _source = None
+    _compiled = None
 
-class CustomUtility():
     def __init__(self, code):
         self.code = code
-    def __call__(self, f_i):
+
+    # the formula is validated and compiled once per distinct text, None if it is invalid
+    def compiled(self):
+        if self._source != self.code:
+            self._source = self.code
+            try:
+                self._compiled = compile_expression(self.code)
+            except ValueError:
+                self._compiled = None
+        return self._compiled
+
+    def evaluate_scalar(self, f_i):
         try:
-            return float(evaluate(self.code, {"frac":f_i}))
+            return float(eval(self._compiled, scalar_globals, {"frac": f_i}))
         except:
             return 0.0
 
-class SinglePeakedUtility():
+    def __call__(self, f_i):
+        code = self.compiled()
+        if not isinstance(f_i, np.ndarray):
+            return 0.0 if code is None else self.evaluate_scalar(f_i)
+        if code is None:
+            return np.zeros(f_i.shape)
+        try:
+            with np.errstate(all='raise'):
+                return np.broadcast_to(np.asarray(eval(code, array_globals, {"frac": f_i}), dtype=float), f_i.shape).copy()
+        except:
+            return np.vectorize(self.evaluate_scalar, otypes=[float])(f_i)
+
+    def table(self):
+        if self._table is None:
+            same, other = np.indices((MAX_NEIGHBORS+1, MAX_NEIGHBORS+1))
+            total = same + other
+            self._table = self(np.divide(same, total, out=np.zeros(total.shape), where=total > 0))
+        return self._table
+
+class SinglePeakedUtility(Utility):
     def __init__(self, peak):
         self.peak = peak
         
@@ -42,14 +122,14 @@ class SinglePeakedUtility():
             f_i = self.peak / (1.0-self.peak) * (1.0-f_i)
         return f_i / self.peak
     
-class TauUtility():
+class TauUtility(Utility):
     def __init__(self, tau):
         self.tau = tau
         
     def __call__(self, f_i):
         return min(f_i, self.tau)
     
-class PlateauUtility(ABC):
+class PlateauUtility(Utility, ABC):
     def __init__(self, l, r):
         assert l <= r and 0 <= l and r <= 1
         self.l = l
@@ -77,7 +157,7 @@ class CentralRectangularUtility(RectangularUtility):
     def __init__(self, size):
         super().__init__(0.5-size/2, 0.5+size/2)
     
-class TauNoSegUtility():
+class TauNoSegUtility(Utility):
     def __init__(self, tau):
         self.tau = tau
         
@@ -85,3 +165,23 @@ class TauNoSegUtility():
         if f_i == 1.0:
             return 0.0
         return min(f_i, self.tau)
+
+# Utilities are stored as their class name and public attributes, fractions exactly as [numerator, denominator].
+def utility_to_dict(utility):
+    parameters = {}
+    for key, value in vars(utility).items():
+        if key[0] == '_': continue
+        if isinstance(value, Fraction):
+            value = [value.numerator, value.denominator]
+        elif isinstance(value, np.generic):
+            value = value.item()
+        parameters[key] = value
+    return {"class": type(utility).__name__, "parameters": parameters}
+
+def utility_from_dict(description):
+    cls = globals()[description["class"]]
+    if not (isinstance(cls, type) and issubclass(cls, Utility)): raise ValueError(description["class"])
+    utility = cls.__new__(cls)
+    for key, value in description["parameters"].items():
+        setattr(utility, key, Fraction(*value) if isinstance(value, list) else value)
+    return utility